@@ -1,7 +1,12 @@
 import argparse
+import queue
+import re
 import serial
+import threading
 import time
+import traceback
 
+from collections import deque
 from pprint import pprint
 
 from secrets import *
@@ -10,7 +15,11 @@ from mouser import Mouser
 from digikey import DigiKey
 from lcsc import LCSC
 from partkeepr import PartKeepr
-from flipdot import Flipdot
+from catalog import PartCatalog, PartIndex
+from response_cache import ResponseCache
+from photo_index import PhotoIndex
+from stock_queue import StockQueue
+from flipdot import Flipdot, FlipdotWriter
 from distributor_common import SUPPORTED_DISTRIBUTORS, get_part_data
 
 
@@ -18,18 +27,46 @@ from distributor_common import SUPPORTED_DISTRIBUTORS, get_part_data
 DEFAULT_CATEGORY = "/api/part_categories/1"
 DEFAULT_STORAGE_LOCATION = "/api/storage_locations/11"
 
+# How often and how many seconds apart to try reopening the scanner port after it failed
+SCANNER_REOPEN_ATTEMPTS = 30
+SCANNER_REOPEN_DELAY = 2
+
 
 class BarcodeClient:
-    def __init__(self, scanner_port, scanner_baudrate=9600, flipdot_port=None, flipdot_baudrate=57600):
+    def __init__(self, scanner_port, scanner_baudrate=9600, flipdot_port=None, flipdot_baudrate=57600, flipdot_partial_updates=False, catalog_file=None, catalog_max_age=3600, distributor_cache_file=".distributor_cache", index_refresh_interval=600, stock_queue_file=".stock_queue", photo_index_file=".photo_index"):
         self.pk = PartKeepr(PK_BASE_URL, PK_USERNAME, PK_PASSWORD)
+        if photo_index_file:
+            self.pk.photo_index = PhotoIndex(photo_index_file)
+        if catalog_file:
+            self.source = PartCatalog(self.pk, catalog_file, catalog_max_age)
+        else:
+            self.source = self.pk
+        print("Loading part index")
+        self.index = PartIndex(self.pk, self.source, index_refresh_interval)
+        self.index.load()
+        self.index.start_refresh()
+        self.stock_queue = StockQueue(self.pk, stock_queue_file)
+        print("Stock queue: {} changes pending, {} failed".format(self.stock_queue.count(), self.stock_queue.count(failed=True)))
         self.tme = TME(TME_APP_KEY, TME_APP_SECRET)
         self.mouser = Mouser(MOUSER_API_KEY)
         self.digikey = DigiKey(DIGIKEY_CLIENT_ID, DIGIKEY_CLIENT_SECRET)
         self.lcsc = LCSC()
+        if distributor_cache_file:
+            self.cache = ResponseCache(distributor_cache_file)
+        else:
+            self.cache = None
         
-        self.scanner = serial.Serial(scanner_port, baudrate=scanner_baudrate, timeout=1.0)
+        self.scanner = serial.Serial(scanner_port, baudrate=scanner_baudrate, timeout=None)
+        self.events = queue.Queue()
+        self.jobs = queue.Queue()
+        self.deferred = deque()
+        self.pending = False
         if flipdot_port:
-            self.display = Flipdot(flipdot_port, flipdot_baudrate, 126, 16)
+            # Display updates are written in the background, only the latest screen is kept
+            self.display = FlipdotWriter(Flipdot(flipdot_port, flipdot_baudrate, 126, 16, flipdot_partial_updates))
+            self.display.start()
+            # Whatever the display showed before, start from a known blank frame
+            self.display.display_multiline_text("", force=True)
         else:
             self.display = None
         self.current_part = None
@@ -53,234 +90,317 @@ class BarcodeClient:
     def display_part(self, part, timeout):
         print("  Part Name: {}".format(part['name']))
         print("  Stock Level: {}".format(part['stockLevel']))
-        self.display_text("{}\nSTOCK: {} @ {}".format(part['name'], part['stockLevel'], part['storageLocation']['name']), timeout)
+        # Show the stock including queued changes, marked with * as PartKeepr hasn't confirmed them yet
+        stock_level, num_queued = self.stock_queue.get_expected_stock(part['@id'], part['stockLevel'])
+        if num_queued:
+            print("  Stock Level with {} queued changes: {}".format(num_queued, stock_level))
+        self.display_text("{}\nSTOCK: {}{} @ {}".format(part['name'], stock_level, "*" if num_queued else "", part['storageLocation']['name']), timeout)
+    
+    def clear_display(self):
+        print("Clearing display")
+        # Sent in full, so a display that missed updates is blank again
+        self.display.display_multiline_text("", force=True)
+        self.display_idle = True
+        self.reset_state()
+    
+    def get_display_wait(self):
+        # Seconds until the display has to be cleared, None if it is idle or waiting for a request
+        if not self.display or self.display_idle or self.pending:
+            return None
+        return max(0, self.display_timeout - (time.time() - self.display_last_refresh))
+    
+    def read_scanner(self):
+        # Runs in its own thread, blocking on the serial port until data arrives.
+        # Codes end with CR and/or LF; bytes of a code that is still being received stay buffered.
+        # A port error (e.g. the scanner being unplugged) is handed to the main loop, which reopens the port.
+        buffer = b""
+        while True:
+            try:
+                buffer += self.scanner.read(1)
+                buffer += self.scanner.read(self.scanner.in_waiting)
+            except serial.SerialException as e:
+                self.events.put(('scanner_failed', e))
+                return
+            *codes, buffer = re.split(b"[\r\n]", buffer)
+            for code in codes:
+                if code:
+                    self.events.put(('scan', code.decode('ascii', errors='replace')))
+    
+    def reopen_scanner(self, error):
+        # Gives up and raises the original error if the port does not come back
+        for attempt in range(SCANNER_REOPEN_ATTEMPTS):
+            time.sleep(SCANNER_REOPEN_DELAY)
+            print("Reopening scanner port (attempt {}/{})".format(attempt + 1, SCANNER_REOPEN_ATTEMPTS))
+            try:
+                self.scanner.close()
+                self.scanner.open()
+            except serial.SerialException as e:
+                print("  Failed: {}".format(e))
+                continue
+            threading.Thread(target=self.read_scanner, daemon=True).start()
+            self.display_text("SCANNER READY", 20)
+            return
+        raise error
+    
+    def run_api_worker(self):
+        # Runs in its own thread and sends the PartKeepr and distributor API calls one at a time,
+        # handing the results back to the main loop as events
+        while True:
+            func, args, callback = self.jobs.get()
+            try:
+                result = func(*args)
+            except Exception:
+                traceback.print_exc()
+                self.events.put(('failed', callback, None))
+                continue
+            self.events.put(('done', callback, result))
+    
+    def submit(self, func, args, callback):
+        # Run func(*args) in the background; callback(result) is called by the main loop once it is done.
+        # Scans coming in until then are deferred, so they are still handled in order.
+        self.pending = True
+        self.display_text("PENDING", 300)
+        self.jobs.put((func, args, callback))
+    
+    def reset_state(self):
+        self.state = 'idle'
+        self.current_part = None
+        self.current_action = ""
+        self.current_value_digits = ""
+        self.current_distributor = ""
+        self.current_order_no = ""
     
     def loop(self):
+        self.stock_queue.start()
+        threading.Thread(target=self.read_scanner, daemon=True).start()
+        threading.Thread(target=self.run_api_worker, daemon=True).start()
         while True:
-            if self.display and not self.display_idle and time.time() - self.display_last_refresh >= self.display_timeout:
-                print("Clearing display")
-                self.display.display_multiline_text("")
-                self.display_idle = True
-                self.state = 'idle'
-                self.current_part = None
-                self.current_action = ""
-                self.current_value_digits = ""
-                self.current_distributor = ""
-                self.current_order_no = ""
+            if not self.pending and self.deferred:
+                self.handle_code(self.deferred.popleft())
+                continue
             
-            code = self.scanner.read(self.scanner.inWaiting()).decode('ascii').rstrip("\r\n")
-            if not code:
-                time.sleep(0.1)
+            # Wake up for the next event or when the display times out, whichever comes first
+            try:
+                event = self.events.get(timeout=self.get_display_wait())
+            except queue.Empty:
+                self.clear_display()
                 continue
-            print("Code scanned: {}".format(code))
             
-            state_machine_done = False
+            if event[0] == 'scan':
+                code = event[1]
+                print("Code scanned: {}".format(code))
+                if self.pending:
+                    print("  Waiting for pending request")
+                    self.deferred.append(code)
+                else:
+                    self.handle_code(code)
+            elif event[0] == 'done':
+                self.pending = False
+                event[1](event[2])
+            elif event[0] == 'failed':
+                self.pending = False
+                print("  Request failed!")
+                self.display_text("REQUEST FAILED", 20)
+                self.reset_state()
+            elif event[0] == 'scanner_failed':
+                print("Scanner port failed: {}".format(event[1]))
+                self.display_text("SCANNER ERROR", 300)
+                self.reopen_scanner(event[1])
+    
+    def on_part_loaded(self, part):
+        if '@id' not in part:
+            print("  Part not found!")
+            self.display_text("PART NOT FOUND", 20)
+            self.reset_state()
+            return
+        self.state = 'part_scanned'
+        self.current_part = part
+        self.display_part(self.current_part, 300)
+    
+    def on_order_no_looked_up(self, parts):
+        code = self.current_order_no
+        if len(parts) > 1:
+            print("  Ambiguous order number!")
+            print("  Found parts:")
+            print("\n".join(["    " + part['name'] for part in parts]))
+            self.display_text("{}\nAMBIGUOUS ORDER NO".format(code), 20)
+            self.state = 'idle'
+            self.current_distributor = ""
+        elif len(parts) == 0:
+            print("  Part not found!")
+            self.display_text("{}\nNOT FOUND. CREATE NEW?".format(code), 300)
+            self.state = 'create_new_part_question'
+        else:
+            self.state = 'part_scanned'
+            self.current_part = parts[0]
+            self.current_distributor = ""
+            self.current_order_no = ""
+            self.display_part(self.current_part, 300)
+    
+    def create_part(self, distributor_code, order_no):
+        # Runs on the API worker. Returns the new part, or None and the error to display.
+        distributor_name = SUPPORTED_DISTRIBUTORS[distributor_code]
+        part_data = get_part_data(distributor_name, order_no, self.tme, self.mouser, self.digikey, self.lcsc, self.cache)
+        if not part_data:
+            print("Failed to get part data from {}".format(distributor_name))
+            return None, "PART DATA GET FAIL"
+        
+        print("  Creating new part")
+        print("Getting distributors")
+        distributors = self.source.get_distributors()
+        dist_id = None
+        for dist in distributors:
+            if dist['name'] == distributor_name:
+                dist_id = dist['@id']
+                break
+        
+        print("Creating part distributor")
+        part_distributor_new = {
+            'distributor': {
+                '@id': dist_id
+            },
+            'price': "0.00000",
+            'orderNumber': order_no
+        }
+        part_distributor = self.pk.create_part_distributor(part_distributor_new)
+        if '@id' not in part_distributor:
+            pprint(part_distributor)
+            print("Failed to create part distributor")
+            return None, "PART DIST CREATE FAIL"
+        
+        part_new = {
+            'name': part_data['manufacturer_part_no'],
+            'category': {
+                '@id': DEFAULT_CATEGORY
+            },
+            'distributors': [
+                {
+                    '@id': part_distributor['@id']
+                }
+            ],
+            'storageLocation': {
+                '@id': DEFAULT_STORAGE_LOCATION
+            }
+        }
+        part = self.pk.create_part(part_new)
+        if '@id' not in part:
+            pprint(part)
+            print("Failed to create part")
+            return None, "PART CREATE FAIL"
+        
+        part = self.pk.update_part_data(part, part_data, part['distributors'][0])
+        if '@id' not in part:
+            pprint(part)
+            print("Failed to update part")
+            return None, "PART UPDATE FAIL"
+        return part, None
+    
+    def on_part_created(self, result):
+        part, error = result
+        if error:
+            self.display_text(error, 20)
+            self.state = 'idle'
+            self.current_distributor = ""
+            self.current_order_no = ""
+            return
+        self.state = 'part_scanned'
+        self.current_part = part
+        self.current_distributor = ""
+        self.current_order_no = ""
+        self.display_part(self.current_part, 300)
+    
+    def handle_code(self, code):
+        state_machine_done = False
+        
+        if not state_machine_done and self.state in ['idle', 'part_scanned', 'action_scanned', 'value_scanned']:
+            # P: Part ID
+            if code.startswith("P"):
+                part_id = code[1:]
+                self.reset_state()
+                self.submit(self.index.get_part, (part_id,), self.on_part_loaded)
+                state_machine_done = True
             
-            if not state_machine_done and self.state in ['idle', 'part_scanned', 'action_scanned', 'value_scanned']:
-                # P: Part ID
-                if code.startswith("P"):
-                    part_id = code[1:]
-                    self.state = 'part_scanned'
-                    self.current_part = self.pk.get_part(part_id)
-                    self.current_action = ""
-                    self.current_value_digits = ""
-                    self.current_distributor = ""
-                    self.current_order_no = ""
-                    self.display_part(self.current_part, 300)
-                    state_machine_done = True
+            # D: Expect distributor-specific code
+            if code.startswith("D"):
+                self.state = 'distributor'
+                self.current_part = None
+                self.current_action = ""
+                self.current_value_digits = ""
+                self.current_distributor = code[1:]
+                self.current_order_no = ""
+                print("  Expect distributor-specific barcode: {}".format(self.current_distributor))
+                self.display_text("SCAN {} CODE".format(self.current_distributor), 300)
+                state_machine_done = True
+        
+        if not state_machine_done and self.state in ['part_scanned', 'action_scanned', 'value_scanned']:
+            # A: Action
+            if code.startswith("A"):
+                self.state = 'action_scanned'
+                self.current_action = code[1:]
+                self.current_value_digits = ""
+                print("  Action: {}".format(self.current_action))
+                self.display_text("{}\nACT: {} VAL: {}".format(self.current_part.get('name'), self.current_action, self.current_value_digits), 300)
+                state_machine_done = True
+        
+        if not state_machine_done and self.state in ['action_scanned', 'value_scanned']:
+            # V: Value
+            if code.startswith("V"):
+                value_digit = code[1:]
+                print("  Value digit: {}".format(value_digit))
+                self.state = 'value_scanned'
+                self.current_value_digits += value_digit
+                self.display_text("{}\nACT: {} VAL: {}".format(self.current_part.get('name'), self.current_action, self.current_value_digits), 300)
+                state_machine_done = True
+        
+        if not state_machine_done and self.state in ['value_scanned']:
+            # C: Confirm
+            if code == "C":
+                print("  * CONFIRM")
+                value = int(self.current_value_digits)
                 
-                # D: Expect distributor-specific code
-                if code.startswith("D"):
-                    self.state = 'distributor'
-                    self.current_part = None
-                    self.current_action = ""
-                    self.current_value_digits = ""
-                    self.current_distributor = code[1:]
-                    self.current_order_no = ""
-                    print("  Expect distributor-specific barcode: {}".format(self.current_distributor))
-                    self.display_text("SCAN {} CODE".format(self.current_distributor), 300)
-                    state_machine_done = True
-            
-            if not state_machine_done and self.state in ['part_scanned', 'action_scanned', 'value_scanned']:
-                # A: Action
-                if code.startswith("A"):
-                    self.state = 'action_scanned'
-                    self.current_action = code[1:]
-                    self.current_value_digits = ""
-                    print("  Action: {}".format(self.current_action))
-                    self.display_text("{}\nACT: {} VAL: {}".format(self.current_part.get('name'), self.current_action, self.current_value_digits), 300)
-                    state_machine_done = True
-            
-            if not state_machine_done and self.state in ['action_scanned', 'value_scanned']:
-                # V: Value
-                if code.startswith("V"):
-                    value_digit = code[1:]
-                    print("  Value digit: {}".format(value_digit))
-                    self.state = 'value_scanned'
-                    self.current_value_digits += value_digit
-                    self.display_text("{}\nACT: {} VAL: {}".format(self.current_part.get('name'), self.current_action, self.current_value_digits), 300)
-                    state_machine_done = True
-            
-            if not state_machine_done and self.state in ['value_scanned']:
-                # C: Confirm
-                if code == "C":
-                    print("  * CONFIRM")
-                    value = int(self.current_value_digits)
-                    
-                    if self.current_action == "ADD":
-                        print("    Adding {} to stock".format(value))
-                        result = self.pk.part_add_stock(self.current_part['@id'], value)
-                        if '@id' not in result:
-                            print("  Error updating part!")
-                            self.display_text("{}\nERROR UPDATING PART".format(self.current_part.get('name')), 20)
-                        else:
-                            print("    New stock level: {}".format(result['stockLevel']))
-                            self.display_text("{}\nNEW STOCK: {}".format(self.current_part.get('name'), result['stockLevel']), 20)
-                    
-                    elif self.current_action == "SUB":
-                        print("    Subtracting {} from stock".format(value))
-                        result = self.pk.part_remove_stock(self.current_part['@id'], value)
-                        if '@id' not in result:
-                            print("  Error updating part!")
-                            self.display_text("{}\nERROR UPDATING PART".format(self.current_part.get('name')), 20)
-                        else:
-                            print("    New stock level: {}".format(result['stockLevel']))
-                            self.display_text("{}\nNEW STOCK: {}".format(self.current_part.get('name'), result['stockLevel']), 20)
-                    
-                    elif self.current_action == "SET":
-                        print("    Setting stock to {}".format(value))
-                        result = self.pk.part_set_stock(self.current_part['@id'], value)
-                        if '@id' not in result:
-                            print("  Error updating part!")
-                            self.display_text("{}\nERROR UPDATING PART".format(self.current_part.get('name')), 20)
-                        else:
-                            print("    New stock level: {}".format(result['stockLevel']))
-                            self.display_text("{}\nNEW STOCK: {}".format(self.current_part.get('name'), result['stockLevel']), 20)
-                    
-                    self.state = 'idle'
-                    self.current_part = None
-                    self.current_action = ""
-                    self.current_value_digits = ""
-                    state_machine_done = True
-            
-            if not state_machine_done and self.state in ['distributor']:
+                if self.current_action == "ADD":
+                    print("    Adding {} to stock".format(value))
+                elif self.current_action == "SUB":
+                    print("    Subtracting {} from stock".format(value))
+                elif self.current_action == "SET":
+                    print("    Setting stock to {}".format(value))
+                
+                # Stock changes go through the local queue so they are never lost if PartKeepr is unreachable
+                if self.current_action in StockQueue.ACTIONS:
+                    self.stock_queue.enqueue(self.current_part['@id'], self.current_action, value)
+                    self.display_text("{}\nQUEUED: {} {}".format(self.current_part.get('name'), self.current_action, value), 20)
+                
+                self.state = 'idle'
+                self.current_part = None
+                self.current_action = ""
+                self.current_value_digits = ""
+                state_machine_done = True
+        
+        if not state_machine_done and self.state in ['distributor']:
+            if self.current_distributor in SUPPORTED_DISTRIBUTORS:
+                self.current_order_no = code
+                self.submit(self.index.get_parts, ({"property": "distributors.orderNumber", "operator": "=", "value": code},), self.on_order_no_looked_up)
+            else:
+                self.state = 'idle'
+                self.current_distributor = ""
+            state_machine_done = True
+        
+        if not state_machine_done and self.state in ['create_new_part_question']:
+            # Y: Yes
+            if code == "Y":
                 if self.current_distributor in SUPPORTED_DISTRIBUTORS:
-                    self.current_order_no = code
-                    parts = self.pk.get_parts(filter={"property": "distributors.orderNumber", "operator": "=", "value": code})
-                    if len(parts) > 1:
-                        print("  Ambiguous order number!")
-                        print("  Found parts:")
-                        print("\n".join(["    " + part['name'] for part in parts]))
-                        self.display_text("{}\nAMBIGUOUS ORDER NO".format(code), 20)
-                        self.state = 'idle'
-                        self.current_distributor = ""
-                    elif len(parts) == 0:
-                        print("  Part not found!")
-                        self.display_text("{}\nNOT FOUND. CREATE NEW?".format(code), 300)
-                        self.state = 'create_new_part_question'
-                    else:
-                        self.state = 'part_scanned'
-                        self.current_part = parts[0]
-                        self.current_distributor = ""
-                        self.current_order_no = ""
-                        self.display_part(self.current_part, 300)
+                    self.submit(self.create_part, (self.current_distributor, self.current_order_no), self.on_part_created)
                 else:
-                    self.state = 'idle'
-                    self.current_distributor = ""
-                state_machine_done = True
-            
-            if not state_machine_done and self.state in ['create_new_part_question']:
-                # Y: Yes
-                if code == "Y":
-                    if self.current_distributor in SUPPORTED_DISTRIBUTORS:
-                        part_data = get_part_data(SUPPORTED_DISTRIBUTORS[self.current_distributor], self.current_order_no, self.tme, self.mouser, self.digikey, self.lcsc)
-                        if part_data:
-                            print("  Creating new part")
-                            self.display_text("CREATING PART...", 20)
-                            
-                            print("Getting distributors")
-                            distributors = self.pk.get_distributors()
-                            dist_id = None
-                            for dist in distributors:
-                                if dist['name'] == SUPPORTED_DISTRIBUTORS[self.current_distributor]:
-                                    dist_id = dist['@id']
-                                    break
-                            
-                            print("Creating part distributor")
-                            part_distributor_new = {
-                                'distributor': {
-                                    '@id': dist_id
-                                },
-                                'price': "0.00000",
-                                'orderNumber': self.current_order_no
-                            }
-                            part_distributor = self.pk.create_part_distributor(part_distributor_new)
-                            if '@id' not in part_distributor:
-                                pprint(part_distributor)
-                                print("Failed to create part distributor")
-                                self.display_text("PART DIST CREATE FAIL", 20)
-                                self.state = 'idle'
-                                self.current_distributor = ""
-                                self.current_order_no = ""
-                                continue
-                            
-                            part_new = {
-                                'name': part_data['manufacturer_part_no'],
-                                'category': {
-                                    '@id': DEFAULT_CATEGORY
-                                },
-                                'distributors': [
-                                    {
-                                        '@id': part_distributor['@id']
-                                    }
-                                ],
-                                'storageLocation': {
-                                    '@id': DEFAULT_STORAGE_LOCATION
-                                }
-                            }
-                            part = self.pk.create_part(part_new)
-                            if '@id' not in part:
-                                pprint(part)
-                                print("Failed to create part")
-                                self.display_text("PART CREATE FAIL", 20)
-                                self.state = 'idle'
-                                self.current_distributor = ""
-                                self.current_order_no = ""
-                                continue
-                                
-                            part = self.pk.update_part_data(part, part_data, part['distributors'][0])
-                            if '@id' not in part:
-                                pprint(part)
-                                print("Failed to update part")
-                                self.display_text("PART UPDATE FAIL", 20)
-                                self.state = 'idle'
-                                self.current_distributor = ""
-                                self.current_order_no = ""
-                                continue
-                            
-                            self.state = 'part_scanned'
-                            self.current_part = part
-                            self.current_distributor = ""
-                            self.current_order_no = ""
-                            self.display_part(self.current_part, 300)
-                        else:
-                            print("Failed to get part data from {}".format(SUPPORTED_DISTRIBUTORS[self.current_distributor]))
-                            self.display_text("PART DATA GET FAIL", 20)
-                            self.state = 'idle'
-                            self.current_distributor = ""
-                            self.current_order_no = ""
-                    else:
-                        self.display_text("", 5)
-                        self.state = 'idle'
-                        self.current_distributor = ""
-                        self.current_order_no = ""
-                elif code == "N":
                     self.display_text("", 5)
                     self.state = 'idle'
                     self.current_distributor = ""
                     self.current_order_no = ""
-                state_machine_done = True
-
+            elif code == "N":
+                self.display_text("", 5)
+                self.state = 'idle'
+                self.current_distributor = ""
+                self.current_order_no = ""
+            state_machine_done = True
 
 def main():
     parser = argparse.ArgumentParser()
@@ -288,9 +408,16 @@ def main():
     parser.add_argument("-fp", "--flipdot-port", type=str, required=False, help="Serial port for flipdot display")
     parser.add_argument("-sb", "--scanner-baudrate", type=int, required=False, default=9600, help="Baud rate for the barcode scanner")
     parser.add_argument("-fb", "--flipdot-baudrate", type=int, required=False, default=57600, help="Baud rate for the flipdot display")
+    parser.add_argument("--flipdot-partial-updates", action="store_true", help="Only send changed columns to the flipdot display (needs firmware support)")
+    parser.add_argument("--distributor-cache", type=str, required=False, default=".distributor_cache", help="File to cache distributor responses in (empty to disable)")
+    parser.add_argument("--catalog", type=str, required=False, help="Serve part lookups from a local catalog cache in this file")
+    parser.add_argument("--catalog-max-age", type=int, required=False, default=3600, help="Refresh the local catalog cache if it is older than this many seconds")
+    parser.add_argument("--index-refresh-interval", type=int, required=False, default=600, help="Reload the in-memory part index every this many seconds")
+    parser.add_argument("--stock-queue", type=str, required=False, default=".stock_queue", help="File to queue stock changes in until PartKeepr has confirmed them")
+    parser.add_argument("--photo-index", type=str, required=False, default=".photo_index", help="File remembering uploaded photos so they are reused (empty to disable)")
     args = parser.parse_args()
     
-    client = BarcodeClient(args.scanner_port, args.scanner_baudrate, args.flipdot_port, args.flipdot_baudrate)
+    client = BarcodeClient(args.scanner_port, args.scanner_baudrate, args.flipdot_port, args.flipdot_baudrate, args.flipdot_partial_updates, args.catalog, args.catalog_max_age, args.distributor_cache, args.index_refresh_interval, args.stock_queue, args.photo_index)
     client.loop()
 
 
@@ -0,0 +1,114 @@
+# Counts TLS handshakes made by the distributor clients against local HTTPS stub servers.
+# Needs the openssl command line tool to create a throwaway certificate.
+#
+# Usage: python benchmarks/connections.py
+
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from distributor_common import create_session
+from lcsc import LCSC
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, *args):
+        pass
+    
+    def respond(self):
+        body = json.dumps({'code': 200, 'result': None}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    do_GET = respond
+    do_POST = respond
+
+
+class StubServer(ThreadingHTTPServer):
+    # HTTPS server that counts completed TLS handshakes
+    
+    def __init__(self, context):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.context = context
+        self.handshakes = 0
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+    
+    def get_request(self):
+        sock, addr = self.socket.accept()
+        sock = self.context.wrap_socket(sock, server_side=True)
+        with self.lock:
+            self.handshakes += 1
+        return sock, addr
+    
+    def handle_error(self, request, client_address):
+        pass
+    
+    @property
+    def url(self):
+        return "https://127.0.0.1:{}".format(self.server_address[1])
+    
+    def reset(self):
+        with self.lock:
+            self.handshakes = 0
+
+
+def create_certificate(directory):
+    cert_file = os.path.join(directory, "cert.pem")
+    key_file = os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key_file, "-out", cert_file], check=True, capture_output=True)
+    return cert_file, key_file
+
+
+def main():
+    num_calls = 50
+    with tempfile.TemporaryDirectory() as directory:
+        cert_file, key_file = create_certificate(directory)
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert_file, key_file)
+        api = StubServer(context)
+        cdn = StubServer(context)
+        
+        # Distributor client against a single API host
+        lcsc = LCSC(rate_limit=1000)
+        lcsc.base_url = api.url
+        # trust_env would let a CA bundle from the environment override the stub certificate
+        lcsc.session.trust_env = False
+        lcsc.session.verify = cert_file
+        for i in range(num_calls):
+            lcsc.get_part_details("C{}".format(i))
+        print("LCSC client, {} calls: {} handshakes".format(num_calls, api.handshakes))
+        
+        # Alternating between API and photo hosts like the Digi-Key client does
+        api.reset()
+        session = create_session()
+        session.trust_env = False
+        session.verify = cert_file
+        for i in range(num_calls):
+            session.get(api.url + "/api")
+            session.get(cdn.url + "/photo.jpg")
+        print("Shared session, {} calls alternating between two hosts: {} + {} handshakes".format(2 * num_calls, api.handshakes, cdn.handshakes))
+        
+        # Without a session every call connects again
+        api.reset()
+        import requests
+        for i in range(num_calls):
+            requests.get(api.url + "/api", verify=cert_file)
+        print("No session, {} calls: {} handshakes".format(num_calls, api.handshakes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Checks Flipdot.pack_bitmap byte for byte against the original per-pixel packing loop
+# and compares their speed. Exits with an error if any frame differs.
+#
+# Usage: python benchmarks/flipdot_pack.py
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PIL import Image
+from flipdot import Flipdot
+
+
+def pack_bitmap_reference(img):
+    # The packing loop Flipdot.commit used before, kept as the reference for the wire format
+    pixels = img.load()
+    width, height = img.size
+    bitmap = []
+    for x in range(width):
+        col_byte = 0x00
+        for y in range(height):
+            if pixels[x, y] > 127:
+                col_byte += 1 << (8 - y%8 - 1)
+            if (y+1) % 8 == 0:
+                bitmap.append(col_byte)
+                col_byte = 0x00
+    return bitmap
+
+
+def random_image(width, height):
+    img = Image.new('L', (width, height))
+    img.putdata([random.randrange(256) for i in range(width * height)])
+    return img
+
+
+def main():
+    random.seed(1)
+    # pack_bitmap doesn't touch the serial port, so no display needs to be connected
+    display = Flipdot.__new__(Flipdot)
+    
+    sizes = [(126, 16), (126, 12), (512, 64), (3, 7), (1, 1), (1, 8)]
+    for width, height in sizes:
+        for i in range(20):
+            img = random_image(width, height)
+            expected = pack_bitmap_reference(img)
+            result = display.pack_bitmap(img)
+            if result != expected:
+                print("MISMATCH for {}x{}:\n  expected {}\n  got      {}".format(width, height, expected, result))
+                sys.exit(1)
+    print("pack_bitmap matches the reference for {} random images each of {}".format(20, ", ".join(["{}x{}".format(w, h) for w, h in sizes])))
+    
+    for width, height in [(126, 16), (512, 64)]:
+        img = random_image(width, height)
+        reference_time = timeit.timeit(lambda: pack_bitmap_reference(img), number=200) / 200
+        new_time = timeit.timeit(lambda: display.pack_bitmap(img), number=200) / 200
+        print("{}x{}: reference {:.0f} us, pack_bitmap {:.0f} us".format(width, height, reference_time * 1e6, new_time * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Local mock of the PartKeepr parts API with Hydra paging and a fixed latency per request.
+# Used by the benchmarks, can also be run on its own.
+#
+# Usage: python benchmarks/mock_partkeepr.py [--port 8765] [--parts 2000] [--latency 0.05]
+
+import argparse
+import json
+import threading
+import time
+import urllib.parse
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, *args):
+        pass
+    
+    def send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_POST(self):
+        # Login
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_json({'username': "mock"})
+    
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        split_url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(split_url.query)
+        page_no = int(query.get('page', ["1"])[0])
+        per_page = self.server.items_per_page
+        num_parts = self.server.num_parts
+        last_page = max(1, (num_parts + per_page - 1) // per_page)
+        
+        data = {
+            'hydra:member': [self.server.get_part(i) for i in range((page_no - 1) * per_page, min(page_no * per_page, num_parts))],
+            'hydra:totalItems': num_parts,
+            'hydra:itemsPerPage': per_page,
+            'hydra:lastPage': "{}?page={}".format(split_url.path, last_page)
+        }
+        if page_no < last_page:
+            data['hydra:nextPage'] = "{}?page={}".format(split_url.path, page_no + 1)
+        self.send_json(data)
+
+
+class MockPartKeepr(ThreadingHTTPServer):
+    def __init__(self, port=0, num_parts=2000, latency=0.05, items_per_page=30):
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.num_parts = num_parts
+        self.latency = latency
+        self.items_per_page = items_per_page
+    
+    def get_part(self, i):
+        return {
+            '@id': "/api/parts/{}".format(i + 1),
+            'name': "Part {}".format(i + 1),
+            'category': {'name': "Resistors"},
+            'storageLocation': {'name': "A{}".format(i // 10)},
+            'distributors': []
+        }
+    
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+    
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, required=False, default=8765, help="Port to listen on")
+    parser.add_argument("--parts", type=int, required=False, default=2000, help="Number of parts served")
+    parser.add_argument("--latency", type=float, required=False, default=0.05, help="Delay of every GET request in seconds")
+    args = parser.parse_args()
+    
+    server = MockPartKeepr(args.port, args.parts, args.latency)
+    print("Serving {} parts on {}".format(args.parts, server.url))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
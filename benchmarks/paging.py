@@ -0,0 +1,36 @@
+# Compares fetching the parts list page by page with fetching pages concurrently,
+# against the local mock PartKeepr API.
+#
+# Usage: python benchmarks/paging.py [--parts 2000] [--latency 0.05]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mock_partkeepr import MockPartKeepr
+from partkeepr import PartKeepr
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--parts", type=int, required=False, default=2000, help="Number of parts served by the mock")
+    parser.add_argument("--latency", type=float, required=False, default=0.05, help="Delay of every mock request in seconds")
+    args = parser.parse_args()
+    
+    server = MockPartKeepr(num_parts=args.parts, latency=args.latency).start()
+    expected = [server.get_part(i)['@id'] for i in range(args.parts)]
+    
+    for concurrency in [1, 2, 4, 8]:
+        pk = PartKeepr(server.url, "user", "password", page_concurrency=concurrency)
+        start = time.time()
+        parts = pk.get_parts()
+        duration = time.time() - start
+        in_order = [part['@id'] for part in parts] == expected
+        print("Concurrency {}: {} parts in {:.2f} s, {}".format(concurrency, len(parts), duration, "in order" if in_order else "WRONG ORDER"))
+
+
+if __name__ == "__main__":
+    main()
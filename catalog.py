@@ -0,0 +1,296 @@
+import hashlib
+import json
+import requests
+import sqlite3
+import threading
+import time
+
+
+class CatalogCollection:
+    # Iterable view of one locally cached collection, with len() like PagedCollection
+    def __init__(self, catalog, collection, filter=None):
+        self.catalog = catalog
+        self.collection = collection
+        self.filter = filter
+    
+    def __len__(self):
+        if self.filter:
+            return sum(1 for item in self)
+        return self.catalog.count(self.collection)
+    
+    def __iter__(self):
+        for item in self.catalog.iter_items(self.collection):
+            if not self.filter or match_filter(item, self.filter):
+                yield item
+
+
+def resolve_property(item, path):
+    # Resolve a dotted PartKeepr filter property like "distributors.orderNumber",
+    # descending into lists of sub-resources
+    values = [item]
+    for key in path.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, list):
+                next_values.extend([entry.get(key) for entry in value if isinstance(entry, dict)])
+            elif isinstance(value, dict):
+                next_values.append(value.get(key))
+        values = next_values
+    result = []
+    for value in values:
+        if isinstance(value, list):
+            result.extend(value)
+        else:
+            result.append(value)
+    return result
+
+
+def match_filter(item, filter):
+    return filter['value'] in resolve_property(item, filter['property'])
+
+
+class PartCatalog:
+    # Local SQLite copy of the PartKeepr catalog.
+    # PartKeepr does not expose modification times, so refreshes walk the collection pages
+    # and only rewrite the pages whose content hash changed since the last refresh.
+    # Writes made through the PartKeepr client are stored immediately.
+    
+    COLLECTIONS = {
+        'parts': "/api/parts",
+        'manufacturers': "/api/manufacturers",
+        'distributors': "/api/distributors",
+        'storage_locations': "/api/storage_locations"
+    }
+    
+    def __init__(self, pk, path=".pkcatalog", max_age=3600):
+        self.pk = pk
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS items (collection TEXT, id TEXT, page INTEGER, data TEXT, PRIMARY KEY (collection, id))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS pages (collection TEXT, page INTEGER, hash TEXT, PRIMARY KEY (collection, page))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS refreshes (collection TEXT PRIMARY KEY, timestamp REAL)")
+        pk.write_listeners.append(self.on_write)
+    
+    def get_collection(self, item_id):
+        for collection, url in self.COLLECTIONS.items():
+            if item_id.startswith(url + "/"):
+                return collection
+        return None
+    
+    def is_stale(self, collection):
+        with self.lock:
+            row = self.db.execute("SELECT timestamp FROM refreshes WHERE collection = ?", (collection,)).fetchone()
+        return row is None or time.time() - row[0] >= self.max_age
+    
+    def refresh(self, collection, force=False):
+        if not force and not self.is_stale(collection):
+            return
+        print("Refreshing catalog: {}".format(collection))
+        num_pages = 0
+        num_changed = 0
+        for page_no, data in enumerate(self.pk.iter_pages(self.COLLECTIONS[collection]), 1):
+            num_pages = page_no
+            members = data['hydra:member']
+            page_hash = hashlib.sha1(json.dumps(members, sort_keys=True).encode('utf-8')).hexdigest()
+            with self.lock, self.db:
+                row = self.db.execute("SELECT hash FROM pages WHERE collection = ? AND page = ?", (collection, page_no)).fetchone()
+                if row and row[0] == page_hash:
+                    continue
+                num_changed += 1
+                self.db.execute("DELETE FROM items WHERE collection = ? AND page = ?", (collection, page_no))
+                self.db.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)", [(collection, item['@id'], page_no, json.dumps(item)) for item in members])
+                self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", (collection, page_no, page_hash))
+        
+        with self.lock, self.db:
+            # Drop pages that no longer exist because items were deleted on the server,
+            # as well as locally stored items the server never confirmed on any page
+            self.db.execute("DELETE FROM items WHERE collection = ? AND (page > ? OR page IS NULL)", (collection, num_pages))
+            self.db.execute("DELETE FROM pages WHERE collection = ? AND page > ?", (collection, num_pages))
+            self.db.execute("INSERT OR REPLACE INTO refreshes VALUES (?, ?)", (collection, time.time()))
+        print("Refreshed catalog: {}, {} of {} pages changed".format(collection, num_changed, num_pages))
+    
+    def refresh_all(self, force=False):
+        for collection in self.COLLECTIONS:
+            self.refresh(collection, force)
+    
+    def count(self, collection):
+        self.refresh(collection)
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM items WHERE collection = ?", (collection,)).fetchone()[0]
+    
+    def iter_items(self, collection):
+        self.refresh(collection)
+        with self.lock:
+            rows = self.db.execute("SELECT data FROM items WHERE collection = ? ORDER BY page, rowid", (collection,)).fetchall()
+        for row in rows:
+            yield json.loads(row[0])
+    
+    def get_item(self, item_id):
+        collection = self.get_collection(item_id)
+        if collection:
+            self.refresh(collection)
+        with self.lock:
+            row = self.db.execute("SELECT data FROM items WHERE collection = ? AND id = ?", (collection, item_id)).fetchone()
+        if row:
+            return json.loads(row[0])
+        item = self.pk.get(item_id)
+        if '@id' in item:
+            self.store(item)
+        return item
+    
+    def store(self, item):
+        collection = self.get_collection(item['@id'])
+        if not collection:
+            return
+        with self.lock, self.db:
+            row = self.db.execute("SELECT page FROM items WHERE collection = ? AND id = ?", (collection, item['@id'])).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)", (collection, item['@id'], row[0] if row else None, json.dumps(item)))
+    
+    def remove(self, item_id):
+        collection = self.get_collection(item_id)
+        if not collection:
+            return
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM items WHERE collection = ? AND id = ?", (collection, item_id))
+    
+    def on_write(self, url, result):
+        # Called by PartKeepr after every successful write
+        if result is None:
+            self.remove(url)
+        elif isinstance(result, dict) and '@id' in result:
+            self.store(result)
+    
+    def get_parts(self, filter=None):
+        return list(self.iter_parts(filter))
+    
+    def iter_parts(self, filter=None):
+        if filter and filter.get('operator', "=") != "=":
+            # Only equality filters can be evaluated locally
+            return self.pk.iter_parts(filter)
+        return CatalogCollection(self, 'parts', filter)
+    
+    def get_part(self, part_id):
+        return self.get_item("/api/parts/{}".format(part_id))
+    
+    def get_manufacturers(self):
+        return list(CatalogCollection(self, 'manufacturers'))
+    
+    def get_distributors(self):
+        return list(CatalogCollection(self, 'distributors'))
+    
+    def get_storage_locations(self):
+        return list(CatalogCollection(self, 'storage_locations'))
+
+
+class PartIndex:
+    # In-memory index of parts by ID and distributor order number, so the barcode client
+    # can answer lookups without a round trip. It is loaded from a catalog source at startup,
+    # kept current with writes made through the PartKeepr client and reloaded periodically
+    # to pick up changes made elsewhere. With a PartCatalog as source, reloads only fetch changed pages.
+    # As the index can be behind the server, misses are confirmed with the server and single parts,
+    # whose stock levels are shown and acted upon, are always read from it.
+    
+    def __init__(self, pk, source, refresh_interval=600):
+        self.pk = pk
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.parts = {}
+        self.parts_by_order_no = {}
+        self.lock = threading.Lock()
+        self.loading = False
+        self.writes_while_loading = []
+        pk.write_listeners.append(self.on_write)
+    
+    def load(self):
+        with self.lock:
+            self.loading = True
+            self.writes_while_loading = []
+        parts = list(self.source.iter_parts())
+        with self.lock:
+            self.parts = {}
+            self.parts_by_order_no = {}
+            for part in parts:
+                self.add(part)
+            # Writes that happened during the load may be newer than what was just loaded
+            for url, result in self.writes_while_loading:
+                self.apply_write(url, result)
+            self.loading = False
+        print("Indexed {} parts, {} order numbers".format(len(self.parts), len(self.parts_by_order_no)))
+    
+    def refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.load()
+            except Exception as e:
+                print("Failed to refresh part index: {}".format(e))
+    
+    def start_refresh(self):
+        threading.Thread(target=self.refresh_loop, daemon=True).start()
+    
+    def add(self, part):
+        # Must be called with the lock held
+        self.discard(part['@id'])
+        self.parts[part['@id']] = part
+        for distributor in part.get('distributors') or []:
+            if distributor.get('orderNumber'):
+                self.parts_by_order_no.setdefault(distributor['orderNumber'], {})[part['@id']] = part
+    
+    def discard(self, part_id):
+        # Must be called with the lock held
+        part = self.parts.pop(part_id, None)
+        if not part:
+            return
+        for distributor in part.get('distributors') or []:
+            parts = self.parts_by_order_no.get(distributor.get('orderNumber'))
+            if parts is not None:
+                parts.pop(part_id, None)
+                if not parts:
+                    del self.parts_by_order_no[distributor['orderNumber']]
+    
+    def apply_write(self, url, result):
+        # Must be called with the lock held
+        if result is None:
+            if url.startswith("/api/parts/"):
+                self.discard(url)
+        elif isinstance(result, dict) and result.get('@id', "").startswith("/api/parts/"):
+            self.add(result)
+    
+    def on_write(self, url, result):
+        # Called by PartKeepr after every successful write
+        with self.lock:
+            self.apply_write(url, result)
+            if self.loading:
+                self.writes_while_loading.append((url, result))
+    
+    def get_part(self, part_id):
+        try:
+            part = self.pk.get_part(part_id)
+        except requests.RequestException as e:
+            # Better an outdated part than none while the server can't be reached
+            with self.lock:
+                part = self.parts.get("/api/parts/{}".format(part_id))
+            if not part:
+                raise
+            print("  Failed to get part, using indexed copy: {}".format(e))
+            return part
+        if '@id' in part:
+            with self.lock:
+                self.add(part)
+        return part
+    
+    def get_parts(self, filter=None):
+        if filter and filter['property'] == "distributors.orderNumber" and filter.get('operator', "=") == "=":
+            with self.lock:
+                parts = list(self.parts_by_order_no.get(filter['value'], {}).values())
+            if parts:
+                return parts
+            # The part may have been added elsewhere since the last reload
+            parts = self.pk.get_parts(filter)
+            with self.lock:
+                for part in parts:
+                    self.add(part)
+            return parts
+        return self.source.get_parts(filter)
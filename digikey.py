@@ -1,31 +1,68 @@
 import json
-import requests
+import os
+import threading
+import time
 
 from pprint import pprint
 
+from distributor_common import DEFAULT_TIMEOUT, create_session
+from ratelimit import RateLimiter
+
 
 class DigiKey:
-    def __init__(self, client_id, client_secret):
+    # Access tokens are refreshed this many seconds before they expire
+    TOKEN_REFRESH_MARGIN = 60
+    
+    def __init__(self, client_id, client_secret, rate_limit=2, pool_size=10, timeout=DEFAULT_TIMEOUT):
         self.base_url = "https://api.digikey.com"
         self.auth_data_file = ".dkauth"
         self.auth_data = None
         self.client_id = client_id
         self.client_secret = client_secret
+        # Digi-Key allows 120 calls per minute
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.session = create_session(pool_size)
+        self.timeout = timeout
+        # Only one thread at a time may authorize or refresh, the others wait for its token.
+        # Digi-Key invalidates the refresh token on every refresh, so parallel refreshes would lock each other out.
+        self.auth_lock = threading.RLock()
+    
+    def load_auth_data(self):
+        try:
+            with open(self.auth_data_file, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
     
     def save_auth_data(self):
-        with open(self.auth_data_file, 'w') as f:
-                json.dump(self.auth_data, f)
+        # Write to a temporary file first so other processes never read a half-written file
+        temp_file = "{}.{}.tmp".format(self.auth_data_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(self.auth_data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.auth_data_file)
+    
+    def set_auth_data(self, response):
+        self.auth_data = {
+            'access_token': response['access_token'],
+            'refresh_token': response['refresh_token'],
+            'expires_at': time.time() + response['expires_in'] if 'expires_in' in response else None
+        }
+        self.save_auth_data()
+    
+    def is_token_expiring(self, auth_data):
+        # Tokens saved without an expiry time are only refreshed once they are rejected
+        return auth_data.get('expires_at') is not None and time.time() >= auth_data['expires_at'] - self.TOKEN_REFRESH_MARGIN
     
     def authorize(self, force_reauth=False):
         reauth = force_reauth
         if not force_reauth:
-            try:
-                # Get existing token from file
-                with open(self.auth_data_file, 'r') as f:
-                    self.auth_data = json.load(f)
+            # Get existing token from file
+            self.auth_data = self.load_auth_data()
+            if self.auth_data:
                 return True
-            except FileNotFoundError:
-                reauth = True
+            reauth = True
         
         if reauth:
             # Obtain Access Token
@@ -38,57 +75,77 @@ class DigiKey:
                 'redirect_uri': "https://example.com",
                 'grant_type': 'authorization_code'
             }
-            response = requests.post(self.base_url + "/v1/oauth2/token", data=data).json()
+            response = self.session.post(self.base_url + "/v1/oauth2/token", data=data, timeout=self.timeout).json()
             if 'access_token' in response:
-                self.auth_data = {
-                    'access_token': response['access_token'],
-                    'refresh_token': response['refresh_token']
-                }
-                self.save_auth_data()
+                self.set_auth_data(response)
                 return True
             return False
         
-    def refresh_access_token(self):
-        if not self.auth_data:
-            return
-        
+    def refresh_access_token(self, stale_token=None):
+        # stale_token is the access token that was found to be expired or rejected.
+        # If another thread or process already replaced it, its token is used instead of refreshing again.
+        with self.auth_lock:
+            auth_data = self.load_auth_data() or self.auth_data
+            if not auth_data:
+                return
+            if auth_data['access_token'] != stale_token and not self.is_token_expiring(auth_data):
+                self.auth_data = auth_data
+                return True
+            return self.request_token_refresh(auth_data['refresh_token'])
+    
+    def request_token_refresh(self, refresh_token):
         data = {
             'client_id': self.client_id,
             'client_secret': self.client_secret,
-            'refresh_token': self.auth_data['refresh_token'],
+            'refresh_token': refresh_token,
             'grant_type': 'refresh_token'
         }
-        response = requests.post(self.base_url + "/v1/oauth2/token", data=data).json()
+        response = self.session.post(self.base_url + "/v1/oauth2/token", data=data, timeout=self.timeout).json()
         if 'access_token' in response:
-            self.auth_data = {
-                'access_token': response['access_token'],
-                'refresh_token': response['refresh_token']
-            }
-            self.save_auth_data()
+            self.set_auth_data(response)
+            return True
+        
+        # Another process may have used the refresh token first
+        auth_data = self.load_auth_data()
+        if auth_data and auth_data['refresh_token'] != refresh_token:
+            self.auth_data = auth_data
             return True
         else:
             # Failed to refresh, completely re-auth
             return self.authorize(force_reauth=True)
         return False
     
+    def get_access_token(self):
+        # Returns a token that is valid for a while yet, refreshing it ahead of time
+        with self.auth_lock:
+            if not self.auth_data:
+                success = self.authorize()
+                if not success:
+                    return None
+            if self.is_token_expiring(self.auth_data):
+                success = self.refresh_access_token(self.auth_data['access_token'])
+                if not success:
+                    return None
+            return self.auth_data['access_token']
+    
     def api_call(self, url, data=None, retry=True):
-        if not self.auth_data:
-            success = self.authorize()
-            if not success:
-                return None
+        access_token = self.get_access_token()
+        if not access_token:
+            print("Failed to get Digi-Key Access Token!")
+            return None
         
         headers = {
             'accept': 'application/json',
-            'Authorization': "Bearer {}".format(self.auth_data['access_token']),
+            'Authorization': "Bearer {}".format(access_token),
             'X-DIGIKEY-Client-Id': self.client_id,
             'X-DIGIKEY-Locale-Site': 'DE',
             'X-DIGIKEY-Locale-Language': 'en',
             'X-DIGIKEY-Locale-Currency': 'EUR',
             'X-DIGIKEY-Customer-Id': "0",
         }
-        response = requests.get(self.base_url + url, headers=headers, data=data).json()
+        response = self.rate_limiter.request(self.session.get, self.base_url + url, headers=headers, data=data, timeout=self.timeout).json()
         if 'ErrorMessage' in response and response['ErrorMessage'] in ("Bearer token  expired", "The Bearer token is invalid"):
-            success = self.refresh_access_token()
+            success = self.refresh_access_token(access_token)
             if not success:
                 print("Failed to refresh Digi-Key Access Token!")
                 return None
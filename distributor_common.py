@@ -1,4 +1,5 @@
 import requests
+import tempfile
 
 
 SUPPORTED_DISTRIBUTORS = {
@@ -8,8 +9,176 @@ SUPPORTED_DISTRIBUTORS = {
     "LCSC": "LCSC"
 }
 
+# (connect, read) timeout in seconds for distributor API calls
+DEFAULT_TIMEOUT = (5, 30)
 
-def get_part_data(distributor, order_no, tme, mouser, digikey, lcsc):
+
+def create_session(pool_size=10):
+    # Session with a keep-alive connection pool large enough for pool_size concurrent requests.
+    # Clients talk to more than one host (Digi-Key photos come from a CDN), so keep a pool for each.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Part data fields that rarely change and are cached for a long time, prices are cached separately
+INFO_KEYS = ('description', 'manufacturer', 'manufacturer_part_no', 'photo', 'parameters')
+
+# Number of API calls needed to fetch the info part of the part data, used to weigh cache eviction
+INFO_COSTS = {
+    "TME": 2
+}
+
+
+def get_tme_prices(tme_prices):
+    prices = []
+    for entry in tme_prices['PriceList']:
+        prices.append({'quantity': entry['Amount'], 'price': entry['PriceValue']})
+    return prices
+
+
+def get_tme_part_data(tme_data, tme_prices, tme_parameters):
+    prices = get_tme_prices(tme_prices)
+    
+    parameters = {}
+    for entry in tme_parameters['ParameterList']:
+        parameters[entry['ParameterName']] = entry['ParameterValue']
+    
+    part_data = {
+        'description': tme_data['Description'],
+        'manufacturer': tme_data['Producer'],
+        'manufacturer_part_no': tme_data['OriginalSymbol'] or tme_data['Symbol'],
+        'photo': tme_data.get('Photo'),
+        'parameters': parameters,
+        'prices': prices
+    }
+    if part_data['photo'] and part_data['photo'].startswith("//"):
+        part_data['photo'] = "https:" + part_data['photo']
+    return part_data
+
+
+def get_cached_part_data(cache, distributor, order_no):
+    # Returns the cached (info, prices) of a part, either may be None if missing or expired
+    if not cache:
+        return None, None
+    return cache.get(distributor, order_no, 'info'), cache.get(distributor, order_no, 'prices')
+
+
+def cache_part_data(cache, distributor, order_no, part_data):
+    if not cache:
+        return
+    cache.put(distributor, order_no, 'info', dict([(key, part_data[key]) for key in INFO_KEYS]), INFO_COSTS.get(distributor, 1))
+    cache.put(distributor, order_no, 'prices', part_data['prices'])
+
+
+# Photos up to this size are kept in memory while they are passed on to PartKeepr
+PHOTO_SPOOL_SIZE = 4 * 1024 * 1024
+
+
+def download_photo(digikey, url):
+    # Streams the photo into a buffer that only goes to disk for unusually large files, so no files
+    # are left in the working directory and parallel downloads can't collide.
+    # Returns a (filename, file, content type) tuple as taken by requests for multipart uploads.
+    # Raises requests.HTTPError or ValueError if the response is not a photo, e.g. an error page.
+    with digikey.session.get(url, timeout=digikey.timeout, stream=True) as response:
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', "")
+        if not content_type.startswith("image/"):
+            raise ValueError("Expected a photo, got {} from {}".format(content_type or "no content type", url))
+        photo = tempfile.SpooledTemporaryFile(max_size=PHOTO_SPOOL_SIZE)
+        for chunk in response.iter_content(64 * 1024):
+            photo.write(chunk)
+    photo.seek(0)
+    return (url.split("/")[-1], photo, content_type)
+
+
+class PhotoDownload:
+    # A photo we have to download ourselves, which is only done once it is uploaded
+    # and the photo index doesn't know the URL yet (see PartKeepr.upload_photo)
+    def __init__(self, digikey, url):
+        self.digikey = digikey
+        self.url = url
+    
+    def download(self):
+        return download_photo(self.digikey, self.url)
+
+
+def finish_part_data(distributor, part_data, digikey):
+    # For some reason, with Digi-Key, PartKeepr only downloads a "Access Denied" page instead of the photo
+    # so we download it ourselves
+    if distributor == "Digi-Key" and part_data['photo']:
+        part_data['photo'] = PhotoDownload(digikey, part_data['photo'])
+    return part_data
+
+
+def get_parts_data(distributor, order_nos, tme, mouser, digikey, lcsc, cache=None):
+    # Get part data for many order numbers of one distributor, keyed by order number.
+    # TME is queried in batches, the other distributors have no batch API and are queried one by one.
+    if distributor == "TME":
+        order_nos = list(dict.fromkeys(order_nos))
+        result = {}
+        cached_infos = {}
+        for order_no in order_nos:
+            info, prices = get_cached_part_data(cache, distributor, order_no)
+            if info is not None and prices is not None:
+                result[order_no] = dict(info, prices=prices)
+            elif info is not None:
+                cached_infos[order_no] = info
+        
+        missing = [order_no for order_no in order_nos if order_no not in result and order_no not in cached_infos]
+        tme_data = tme.get_parts_details(missing) if missing else {}
+        tme_parameters = tme.get_parts_parameters(list(tme_data)) if tme_data else {}
+        need_prices = list(cached_infos) + list(tme_data)
+        tme_prices = tme.get_parts_prices(need_prices) if need_prices else {}
+        
+        for order_no in missing:
+            if order_no not in tme_data or order_no not in tme_prices or order_no not in tme_parameters:
+                print("        Could not get TME data for {}".format(order_no))
+                continue
+            result[order_no] = get_tme_part_data(tme_data[order_no], tme_prices[order_no], tme_parameters[order_no])
+            cache_part_data(cache, distributor, order_no, result[order_no])
+        for order_no, info in cached_infos.items():
+            if order_no not in tme_prices:
+                print("        Could not get TME prices for {}".format(order_no))
+                continue
+            prices = get_tme_prices(tme_prices[order_no])
+            cache.put(distributor, order_no, 'prices', prices)
+            result[order_no] = dict(info, prices=prices)
+        return result
+    
+    result = {}
+    for order_no in order_nos:
+        part_data = get_part_data(distributor, order_no, tme, mouser, digikey, lcsc, cache)
+        if part_data:
+            result[order_no] = part_data
+    return result
+
+
+def get_part_data(distributor, order_no, tme, mouser, digikey, lcsc, cache=None):
+    info, prices = get_cached_part_data(cache, distributor, order_no)
+    if info is not None and prices is not None:
+        return finish_part_data(distributor, dict(info, prices=prices), digikey)
+    
+    if distributor == "TME" and info is not None:
+        # Only the prices expired, which TME lets us fetch on their own
+        tme_prices = tme.get_part_prices(order_no)
+        if 'Error' in tme_prices:
+            print("        TME Part Prices API Error: {}".format(tme_prices['Status']))
+            return None
+        prices = get_tme_prices(tme_prices['Data']['ProductList'][0])
+        cache.put(distributor, order_no, 'prices', prices)
+        return dict(info, prices=prices)
+    
+    part_data = fetch_part_data(distributor, order_no, tme, mouser, digikey, lcsc)
+    if not part_data:
+        return None
+    cache_part_data(cache, distributor, order_no, part_data)
+    return finish_part_data(distributor, part_data, digikey)
+
+
+def fetch_part_data(distributor, order_no, tme, mouser, digikey, lcsc):
     if distributor == "TME":
         tme_data = tme.get_part_details(order_no)
         if 'Error' in tme_data:
@@ -25,10 +194,6 @@ def get_part_data(distributor, order_no, tme, mouser, digikey, lcsc):
         else:
             tme_prices = tme_prices['Data']['ProductList'][0]
         
-        prices = []
-        for entry in tme_prices['PriceList']:
-            prices.append({'quantity': entry['Amount'], 'price': entry['PriceValue']})
-        
         tme_parameters = tme.get_part_parameters(order_no)
         if 'Error' in tme_parameters:
             print("        TME Part Parameters API Error: {}".format(tme_parameters['Status']))
@@ -36,21 +201,7 @@ def get_part_data(distributor, order_no, tme, mouser, digikey, lcsc):
         else:
             tme_parameters = tme_parameters['Data']['ProductList'][0]
         
-        parameters = {}
-        for entry in tme_parameters['ParameterList']:
-            parameters[entry['ParameterName']] = entry['ParameterValue']
-        
-        part_data = {
-            'description': tme_data['Description'],
-            'manufacturer': tme_data['Producer'],
-            'manufacturer_part_no': tme_data['OriginalSymbol'] or tme_data['Symbol'],
-            'photo': tme_data.get('Photo'),
-            'parameters': parameters,
-            'prices': prices
-        }
-        if part_data['photo'].startswith("//"):
-            part_data['photo'] = "https:" + part_data['photo']
-        return part_data
+        return get_tme_part_data(tme_data, tme_prices, tme_parameters)
     elif distributor == "Mouser":
         mouser_data = mouser.get_part_details(order_no)
         if mouser_data['Errors']:
@@ -95,20 +246,10 @@ def get_part_data(distributor, order_no, tme, mouser, digikey, lcsc):
             'description': digikey_data['ProductDescription'],
             'manufacturer': digikey_data['Manufacturer']['Value'],
             'manufacturer_part_no': digikey_data['ManufacturerPartNumber'],
-            'photo': None,
+            'photo': digikey_data.get('PrimaryPhoto'),
             'parameters': parameters,
             'prices': prices
         }
-        
-        # For some reason, with Digi-Key, PartKeepr only downloads a "Access Denied" page instead of the photo
-        # so we download it ourselves
-        if 'PrimaryPhoto' in digikey_data:
-            url = digikey_data['PrimaryPhoto']
-            filename = url.split("/")[-1]
-            with open(filename, 'wb') as f:
-                f.write(requests.get(url).content)
-            part_data['photo'] = open(filename, 'rb')
-        
         return part_data
     elif distributor == "LCSC":
         lcsc_data = lcsc.get_part_details(order_no)
@@ -1,14 +1,73 @@
 import datetime
 import serial
+import threading
+import time
 
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 
 
+# Lookup table for converting greyscale to dots, lit above 127
+THRESHOLD_TABLE = [255 if value > 127 else 0 for value in range(256)]
+
+
+@lru_cache(maxsize=None)
+def get_font(font, size):
+    """
+    Load a truetype font, parsing each font file and size only once.
+    """
+    
+    return ImageFont.truetype(font, size)
+
+
+@lru_cache(maxsize=256)
+def render_text(text, font, size, color):
+    """
+    Render a line of text to a cropped RGBA bitmap.
+    
+    Results are cached, so screens that are shown again only cost a paste.
+    The returned image is shared and must not be modified.
+    """
+    
+    textfont, truetype = get_font(font, size), True
+    approx_tsize = textfont.getsize(text)
+    text_img = Image.new('RGBA', approx_tsize, (0, 0, 0, 0))
+    text_draw = ImageDraw.Draw(text_img)
+    text_draw.fontmode = "1"
+    text_draw.text((0, 0), text, color, font = textfont)
+    if truetype:
+        # font.getsize is inaccurate on non-pixel fonts
+        text_img = text_img.crop(text_img.getbbox())
+    else:
+        # only crop horizontally with pixel fonts
+        bbox = text_img.getbbox()
+        text_img = text_img.crop((bbox[0], 0, bbox[2], text_img.size[1]))
+    return text_img
+
+
+# Opcode of a partial frame: [0xFF, PARTIAL_OPCODE, first column, number of bytes, bytes...]
+PARTIAL_OPCODE = 0xA1
+
+# Bytes in front of the bitmap data of a partial frame
+PARTIAL_HEADER_SIZE = 4
+
+
 class Flipdot:
-    def __init__(self, port, baudrate, width, height):
+    def __init__(self, port, baudrate, width, height, partial_updates=False):
+        """
+        partial_updates:
+        Whether the display firmware understands partial frames. Without them,
+        changed frames are always sent in full.
+        """
+        
         self.width = width
         self.height = height
+        self.partial_updates = partial_updates
         self.port = serial.Serial(port, baudrate=baudrate)
+        self.last_bitmap = None
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+        self.last_bytes_saved = 0
         self.init_image()
     
     def init_image(self):
@@ -123,47 +182,177 @@ class Flipdot:
         if timestring:
             text = datetime.datetime.strftime(datetime.datetime.now(), text)
 
-        textfont, truetype = ImageFont.truetype(font, size), True
-        approx_tsize = textfont.getsize(text)
-        text_img = Image.new('RGBA', approx_tsize, (0, 0, 0, 0))
-        text_draw = ImageDraw.Draw(text_img)
-        text_draw.fontmode = "1"
-        text_draw.text((0, 0), text, color, font = textfont)
-        if truetype:
-            # font.getsize is inaccurate on non-pixel fonts
-            text_img = text_img.crop(text_img.getbbox())
-        else:
-            # only crop horizontally with pixel fonts
-            bbox = text_img.getbbox()
-            text_img = text_img.crop((bbox[0], 0, bbox[2], text_img.size[1]))
-        self.bitmap(text_img, **kwargs)
+        self.bitmap(render_text(text, font, size, color), **kwargs)
 
-    def commit(self):
+    def pack_bitmap(self, img):
         """
         BITMAP FORMAT:
         A list of bytes, two consecutive bytes representing a 16-pixel
         display column from top to bottom.
         """
         
-        pixels = self.img.load()
-        width, height = self.img.size
-        bitmap = []
-        for x in range(width):
-            col_byte = 0x00
-            for y in range(height):
-                if pixels[x, y] > 127:
-                    col_byte += 1 << (8 - y%8 - 1)
-                if (y+1) % 8 == 0:
-                    bitmap.append(col_byte)
-                    col_byte = 0x00
+        # Threshold to 1 bit per pixel and transpose so every display column
+        # becomes one row of the image, which tobytes() packs MSB first.
+        # Rows that don't fill a whole byte are not sent.
+        width, height = img.size
+        img = img.crop((0, 0, width, height - height % 8))
+        img = img.point(THRESHOLD_TABLE, '1')
+        return list(img.transpose(Image.TRANSPOSE).tobytes())
+    
+    def get_dirty_spans(self, old_bitmap, bitmap):
+        """
+        Find the columns that differ between two bitmaps as a list of
+        [first column, end column] spans. Spans that are so close together
+        that a separate header would cost more than the unchanged columns
+        in between are merged.
+        """
+        
+        bytes_per_column = self.height // 8
+        max_gap = PARTIAL_HEADER_SIZE // bytes_per_column
+        spans = []
+        for x in range(len(bitmap) // bytes_per_column):
+            column = slice(x * bytes_per_column, (x + 1) * bytes_per_column)
+            if old_bitmap[column] == bitmap[column]:
+                continue
+            if spans and x - spans[-1][1] <= max_gap:
+                spans[-1][1] = x + 1
+            else:
+                spans.append([x, x + 1])
+        return spans
+    
+    def commit(self, force=False):
+        """
+        Send the image to the display and start a new one.
+        
+        Only the changes since the last frame are sent: nothing if the frame
+        is unchanged, the dirty column spans as partial frames if the display
+        supports them and that is shorter, otherwise the full frame.
+        
+        force:
+        Always send the full frame
+        """
         
+        bitmap = self.pack_bitmap(self.img)
         self.init_image()
-        return self.port.write([0xFF, 0xA0, len(bitmap)] + bitmap)
+        full_frame = [0xFF, 0xA0, len(bitmap)] + bitmap
+        
+        if force or self.last_bitmap is None or len(self.last_bitmap) != len(bitmap):
+            frame = full_frame
+        else:
+            spans = self.get_dirty_spans(self.last_bitmap, bitmap)
+            if not spans:
+                frame = []
+            elif self.partial_updates:
+                bytes_per_column = self.height // 8
+                frame = []
+                for start, end in spans:
+                    data = bitmap[start * bytes_per_column:end * bytes_per_column]
+                    frame += [0xFF, PARTIAL_OPCODE, start, len(data)] + data
+                if len(frame) >= len(full_frame):
+                    frame = full_frame
+            else:
+                frame = full_frame
+        
+        written = 0
+        if frame:
+            try:
+                written = self.port.write(frame)
+            except Exception:
+                # The display may have received part of the frame, so its contents
+                # are unknown and the next frame has to be sent in full
+                self.last_bitmap = None
+                raise
+        
+        self.last_bitmap = bitmap
+        self.last_bytes_saved = len(full_frame) - len(frame)
+        self.bytes_saved += self.last_bytes_saved
+        self.bytes_sent += len(frame)
+        return written
     
-    def display_multiline_text(self, text):
+    def resync(self):
+        """
+        Send the last frame again in full.
+        
+        The display gives no feedback, so if it was reset or missed bytes,
+        it would stay wrong until the affected columns change. Calling this
+        now and then corrects it, even while nothing is being displayed.
+        """
+        
+        if self.last_bitmap is None:
+            return 0
+        frame = [0xFF, 0xA0, len(self.last_bitmap)] + self.last_bitmap
+        try:
+            written = self.port.write(frame)
+        except Exception:
+            self.last_bitmap = None
+            raise
+        self.bytes_sent += len(frame)
+        return written
+    
+    def display_multiline_text(self, text, force=False):
         lines = text.splitlines()
         if len(lines) > 0:
             self.text(lines[0], "flipdot-font/pixelmix.ttf", size=8, halign='left', valign='top')
         if len(lines) > 1:
             self.text(lines[1], "flipdot-font/pixelmix.ttf", size=8, halign='left', valign='bottom')
-        self.commit()
+        self.commit(force)
+
+
+class FlipdotWriter:
+    """
+    Writes to a flipdot display from a background thread, so callers never
+    wait for the serial port. There is a single slot for the next screen:
+    if a new one arrives before the previous one was written, the previous
+    one is dropped, so the display always catches up to the latest screen.
+    
+    As the display only gets the changes between frames, a full frame is
+    sent every resync_interval seconds to correct any missed updates.
+    """
+    
+    def __init__(self, display, resync_interval=60):
+        self.display = display
+        self.resync_interval = resync_interval
+        self.next_text = None
+        self.next_force = False
+        self.last_resync = time.monotonic()
+        self.frames_dropped = 0
+        self.lock = threading.Condition()
+    
+    def display_multiline_text(self, text, force=False):
+        """
+        force:
+        Send the screen as a full frame
+        """
+        
+        with self.lock:
+            if self.next_text is not None:
+                self.frames_dropped += 1
+            self.next_text = text
+            # A dropped screen that had to be sent in full passes that on
+            self.next_force = self.next_force or force
+            self.lock.notify()
+    
+    def run(self):
+        while True:
+            with self.lock:
+                while self.next_text is None:
+                    timeout = self.last_resync + self.resync_interval - time.monotonic()
+                    if timeout <= 0 or not self.lock.wait(timeout):
+                        break
+                text = self.next_text
+                force = self.next_force
+                self.next_text = None
+                self.next_force = False
+            resync_due = time.monotonic() - self.last_resync >= self.resync_interval
+            try:
+                if text is not None:
+                    self.display.display_multiline_text(text, force or resync_due)
+                elif resync_due:
+                    self.display.resync()
+            except Exception as e:
+                print("Failed to update flipdot display: {}".format(e))
+            if force or resync_due:
+                self.last_resync = time.monotonic()
+    
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from code128.format import code128_format
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen.canvas import Canvas
+
+
+# The bundled font, so raster and vector labels use the same font wherever they are generated from
+LABEL_FONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "label-font", "LiberationSans-Regular.ttf")
+
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    # Loaded once per process
+    return ImageFont.truetype(LABEL_FONT, size)
+
+
+@lru_cache(maxsize=None)
+def get_glyph(font_size, char):
+    # Pre-rasterised glyph: coverage mask, horizontal offset of the mask and advance width.
+    # Labels draw the same few characters over and over, so text is built by blitting these.
+    font = get_font(font_size)
+    left, top, right, bottom = font.getbbox(char)
+    offset = min(left, 0)
+    mask = Image.new("L", (max(right - offset, 1), max(bottom, 1)), 0)
+    ImageDraw.Draw(mask).text((-offset, 0), char, 255, font=font)
+    return mask, offset, font.getlength(char)
+
+
+def draw_text(img, xy, text, font_size):
+    # The glyphs are combined into one mask first, keeping the higher coverage where neighbouring
+    # glyphs overlap like FreeType does, so overlapping pixels aren't blended twice
+    x, y = xy
+    glyphs = []
+    for char in text:
+        mask, offset, advance = get_glyph(font_size, char)
+        glyphs.append((round(x) + offset, mask))
+        x += advance
+    if not glyphs:
+        return
+    
+    text_x = min(glyph_x for glyph_x, mask in glyphs)
+    text_width = max(glyph_x + mask.size[0] for glyph_x, mask in glyphs) - text_x
+    text_height = max(mask.size[1] for glyph_x, mask in glyphs)
+    text_mask = Image.new("L", (text_width, text_height), 0)
+    for glyph_x, mask in glyphs:
+        box = (glyph_x - text_x, 0, glyph_x - text_x + mask.size[0], mask.size[1])
+        text_mask.paste(ImageChops.lighter(text_mask.crop(box), mask), box)
+    img.paste('black', (text_x, round(y)), text_mask)
+
+
+@lru_cache(maxsize=None)
+def get_barcode_symbol(widths, height):
+    # One rasterised Code128 symbol, bars and spaces alternating starting with a bar
+    img = Image.new("RGB", (sum(widths), height), 'white')
+    draw = ImageDraw.Draw(img)
+    x = 0
+    for i, width in enumerate(widths):
+        if i % 2 == 0:
+            draw.rectangle(((x, 0), (x + width - 1, height)), fill='black')
+        x += width
+    return img
+
+
+def get_barcode_symbols(data, thickness):
+    # Bar widths of a Code128 barcode split into its symbols, 6 bars and spaces each, 7 for the stop symbol
+    widths = code128_format(data, thickness)
+    return [tuple(widths[i:i + 6]) for i in range(0, len(widths) - 7, 6)] + [tuple(widths[-7:])]
+
+
+def get_label_entry(part):
+    # Reduce a part to what its label shows, which is all that has to be sent to the render processes
+    return (part['@id'], "{}: {}".format(part['category']['name'], part['name']))
+
+
+def get_label_layout(num_entries, label_width_px, label_height_px, font_size):
+    # Grid shared by the raster and vector backends, in pixels from the top left corner
+    margin = round(max(label_height_px * 0.02, label_width_px * 0.02))
+    avail_label_height = label_height_px - 2 * margin
+    avail_label_width = label_width_px - 2 * margin
+    
+    # Split label into base grid with fixed height location tag and variable height parts areas
+    base_x = margin
+    loc_area_y = margin
+    loc_area_height = round(font_size * 1.5)
+    parts_area_y = loc_area_y + loc_area_height
+    parts_area_height = avail_label_height - loc_area_height
+    
+    # Split parts area into evenly-spaced grid
+    parts_area_region_height = parts_area_height // num_entries
+    parts_area_regions_y = []
+    for i in range(num_entries):
+        region_y = parts_area_y + parts_area_region_height * i
+        parts_area_regions_y.append(region_y)
+    
+    return {
+        'base_x': base_x,
+        'loc_area_y': loc_area_y,
+        'avail_label_width': avail_label_width,
+        'parts_area_regions_y': parts_area_regions_y,
+        'barcode_height': parts_area_region_height - round(font_size * 1.5),
+        'barcode_thickness': avail_label_width // 100
+    }
+
+
+def get_label_hash(entries):
+    # Content hash of a label: part IDs, names and category names
+    return hashlib.sha1(json.dumps(sorted(entries)).encode('utf-8')).hexdigest()
+
+
+def load_label_manifest(path):
+    # Label hashes by storage location name from the last run
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_label_manifest(path, manifest):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def render_label(loc_name, entries, label_width_px, label_height_px, font_size):
+    img = Image.new("RGB", (label_width_px, label_height_px), 'white')
+    layout = get_label_layout(len(entries), label_width_px, label_height_px, font_size)
+    
+    draw_text(img, (layout['base_x'], layout['loc_area_y']), "Location: {}".format(loc_name), font_size)
+    
+    for i, (part_uri, barcode_text) in enumerate(sorted(entries)):
+        part_id = part_uri.split("/")[-1]
+        barcode_height = layout['barcode_height']
+        
+        symbols = get_barcode_symbols("P" + part_id, layout['barcode_thickness'])
+        barcode_x = (layout['avail_label_width'] - sum(sum(symbol) for symbol in symbols)) // 2
+        barcode_y = layout['parts_area_regions_y'][i]
+        x = barcode_x
+        for symbol in symbols:
+            img.paste(get_barcode_symbol(symbol, barcode_height), (x, barcode_y))
+            x += sum(symbol)
+        
+        name_x = barcode_x
+        name_y = barcode_y + barcode_height + font_size * 0.1
+        draw_text(img, (name_x, name_y), barcode_text, font_size)
+    
+    return img
+
+
+def render_labels(labels, label_width_px, label_height_px, font_size, workers=1):
+    # Render (location name, entries) pairs, yielding the label images in order.
+    # With more than one worker, labels are rendered in a process pool, but only a few
+    # labels ahead of the consumer so finished pages don't pile up in memory.
+    if workers <= 1:
+        for loc_name, entries in labels:
+            yield render_label(loc_name, entries, label_width_px, label_height_px, font_size)
+        return
+    
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for loc_name, entries in labels:
+            pending.append(executor.submit(render_label, loc_name, entries, label_width_px, label_height_px, font_size))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def save_labels_pdf(images, filename, resolution, pages_per_write=32):
+    # Write label images to a PDF a chunk of pages at a time instead of keeping every page in memory.
+    # Returns the number of pages written.
+    num_pages = 0
+    chunk = []
+    for img in images:
+        chunk.append(img)
+        if len(chunk) >= pages_per_write:
+            chunk[0].save(filename, "PDF", resolution=resolution, save_all=True, append_images=chunk[1:], append=num_pages > 0)
+            num_pages += len(chunk)
+            chunk = []
+    if chunk:
+        chunk[0].save(filename, "PDF", resolution=resolution, save_all=True, append_images=chunk[1:], append=num_pages > 0)
+        num_pages += len(chunk)
+    return num_pages
+
+
+@lru_cache(maxsize=None)
+def get_pdf_font():
+    # Registers the label font for embedding, returns its name and ascent per 1000 units of font size
+    font = TTFont("LabelFont", LABEL_FONT)
+    pdfmetrics.registerFont(font)
+    return "LabelFont", font.face.ascent
+
+
+def draw_label_vector(canvas, loc_name, entries, label_width_px, label_height_px, font_size, resolution):
+    # Draws the same grid as render_label, with bars as filled rectangles and text in the embedded font.
+    # Layout is done in pixels at the label resolution and converted to PDF points here.
+    scale = 72 / resolution
+    font_name, font_ascent = get_pdf_font()
+    layout = get_label_layout(len(entries), label_width_px, label_height_px, font_size)
+    
+    def draw_text(x, y, text):
+        # PIL places text by the top of the ascender, PDF by the baseline
+        baseline_y = y + font_ascent * font_size / 1000
+        canvas.drawString(x * scale, (label_height_px - baseline_y) * scale, text)
+    
+    canvas.setFont(font_name, font_size * scale)
+    canvas.setFillColorRGB(0, 0, 0)
+    draw_text(layout['base_x'], layout['loc_area_y'], "Location: {}".format(loc_name))
+    
+    for i, (part_uri, barcode_text) in enumerate(sorted(entries)):
+        part_id = part_uri.split("/")[-1]
+        barcode_height = layout['barcode_height']
+        
+        bar_widths = code128_format("P" + part_id, layout['barcode_thickness'])
+        barcode_x = (layout['avail_label_width'] - sum(bar_widths)) // 2
+        barcode_y = layout['parts_area_regions_y'][i]
+        
+        # Bars and spaces alternate, starting with a bar
+        x = barcode_x
+        for j, width in enumerate(bar_widths):
+            if j % 2 == 0:
+                canvas.rect(x * scale, (label_height_px - barcode_y - barcode_height) * scale, width * scale, barcode_height * scale, stroke=0, fill=1)
+            x += width
+        
+        draw_text(barcode_x, barcode_y + barcode_height + font_size * 0.1, barcode_text)
+
+
+def save_labels_vector_pdf(labels, filename, label_width_px, label_height_px, font_size, resolution):
+    # Writes (location name, entries) pairs as a vector PDF, one page per label.
+    # Returns the number of pages written.
+    scale = 72 / resolution
+    canvas = Canvas(filename, pagesize=(label_width_px * scale, label_height_px * scale), pageCompression=1)
+    num_pages = 0
+    for loc_name, entries in labels:
+        draw_label_vector(canvas, loc_name, entries, label_width_px, label_height_px, font_size, resolution)
+        canvas.showPage()
+        num_pages += 1
+    canvas.save()
+    return num_pages
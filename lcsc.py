@@ -1,12 +1,16 @@
-import requests
+from distributor_common import DEFAULT_TIMEOUT, create_session
+from ratelimit import RateLimiter
 
 
 class LCSC:
-    def __init__(self):
+    def __init__(self, rate_limit=5, pool_size=10, timeout=DEFAULT_TIMEOUT):
         self.base_url = "https://wmsc.lcsc.com"
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.session = create_session(pool_size)
+        self.timeout = timeout
     
     def get_part_details(self, order_no):
         full_url = self.base_url + "/wmsc/product/detail"
         url_params = {'productCode': order_no}
         cookies = {'currencyCode': "EUR"}
-        return requests.get(full_url, params=url_params, cookies=cookies).json()
+        return self.rate_limiter.request(self.session.get, full_url, params=url_params, cookies=cookies, timeout=self.timeout).json()
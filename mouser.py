@@ -1,10 +1,22 @@
-import requests
+from distributor_common import DEFAULT_TIMEOUT, create_session
+from ratelimit import RateLimiter
 
 
 class Mouser:
-    def __init__(self, api_key):
+    def __init__(self, api_key, rate_limit=0.5, pool_size=10, timeout=DEFAULT_TIMEOUT):
         self.base_url = "https://api.mouser.com"
         self.api_key = api_key
+        # Mouser allows 30 calls per minute
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.session = create_session(pool_size)
+        self.timeout = timeout
+    
+    def is_rate_limited(self, response):
+        try:
+            errors = response.json().get('Errors') or []
+        except ValueError:
+            return False
+        return any(error.get('Code') == "TooManyRequests" or "Maximum calls" in (error.get('Message') or "") for error in errors)
     
     def get_part_details(self, order_no):
         full_url = self.base_url + "/api/v2/search/partnumber"
@@ -15,4 +27,4 @@ class Mouser:
                 'partSearchOptions': None
             }
         }
-        return requests.post(full_url, params=url_params, json=json).json()
+        return self.rate_limiter.request(self.session.post, full_url, params=url_params, json=json, timeout=self.timeout, is_limited=self.is_rate_limited).json()
@@ -1,50 +1,145 @@
-import io
+import copy
+import hashlib
 import json
-import os
+import math
 import requests
+import threading
+import urllib.parse
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from distributor_common import DEFAULT_TIMEOUT, PhotoDownload
+
+
+class PagedCollection:
+    # Lazy view of a paged collection that fetches pages only while it is being iterated
+    def __init__(self, pk, url, params=None, concurrency=None):
+        self.pk = pk
+        self.url = url
+        self.params = params
+        self.concurrency = concurrency
+        self.first_page = None
+    
+    def get_first_page(self):
+        if self.first_page is None:
+            self.first_page = self.pk.get(self.url, params=self.params)
+        return self.first_page
+    
+    def __len__(self):
+        return self.get_first_page()['hydra:totalItems']
+    
+    def __iter__(self):
+        for data in self.pk.iter_pages(self.url, self.params, self.concurrency, first_page=self.get_first_page()):
+            yield from data['hydra:member']
 
 
 class PartKeepr:
-    def __init__(self, base_url, username, password):
+    def __init__(self, base_url, username, password, page_concurrency=1, timeout=DEFAULT_TIMEOUT):
         # base_url is something like https://my.partkeepr.host (no trailing slash)
         self.base_url = base_url
+        # (connect, read) timeout in seconds, so a stalled connection can't block a caller forever
+        self.timeout = timeout
+        # Number of pages of a collection to fetch at the same time
+        self.page_concurrency = page_concurrency
         self.session = requests.Session()
         self.session.auth = (username, password)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(page_concurrency, 10))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Callables that get (url, result) after every write, result is None for deletions
+        self.write_listeners = []
+        self.manufacturer_lock = threading.Lock()
+        # Number of sub-resource writes sent and skipped by apply_part_update, by kind
+        self.writes_performed = Counter()
+        self.writes_skipped = Counter()
+        self.stats_lock = threading.Lock()
+        # Optional PhotoIndex to reuse photos that were uploaded before
+        self.photo_index = None
         self.user = self.login()
     
     def login(self):
-        return self.session.post(self.base_url + "/api/users/login").json()
+        return self.session.post(self.base_url + "/api/users/login", timeout=self.timeout).json()
     
     def get(self, url, params=None):
-        return self.session.get(self.base_url + url, params=params).json()
+        return self.session.get(self.base_url + url, params=params, timeout=self.timeout).json()
+    
+    def notify_write(self, url, result):
+        for listener in self.write_listeners:
+            listener(url, result)
+        return result
     
     def create(self, url, data, params=None):
-        return self.session.post(self.base_url + url, json=data, params=params).json()
+        return self.notify_write(url, self.session.post(self.base_url + url, json=data, params=params, timeout=self.timeout).json())
     
     def update(self, url, data, params=None):
-        return self.session.put(self.base_url + url, json=data, params=params).json()
+        return self.notify_write(url, self.session.put(self.base_url + url, json=data, params=params, timeout=self.timeout).json())
     
     def delete(self, url, params=None):
-        self.session.delete(self.base_url + url, params=params)
+        self.session.delete(self.base_url + url, params=params, timeout=self.timeout)
+        self.notify_write(url, None)
     
     def upload(self, url, file, params=None):
-        return self.session.post(self.base_url + url, files=file, params=params).json()
+        return self.session.post(self.base_url + url, files=file, params=params, timeout=self.timeout).json()
+    
+    def get_page_count(self, data):
+        # Work out the number of pages from the Hydra metadata of the first page
+        last_page = data.get('hydra:lastPage')
+        if last_page:
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(last_page).query)
+            if 'page' in query:
+                return int(query['page'][0])
+        if data.get('hydra:totalItems') is not None and data.get('hydra:itemsPerPage'):
+            return math.ceil(data['hydra:totalItems'] / data['hydra:itemsPerPage'])
+        return None
     
-    def get_paged(self, url, params=None):
-        result = []
-        next_page = url
+    def get_page_url(self, url, page_no):
+        # Build the URL of an arbitrary page from the URL of another page of the same collection
+        split_url = urllib.parse.urlsplit(url)
+        query = [(key, value) for key, value in urllib.parse.parse_qsl(split_url.query) if key != 'page']
+        query.append(('page', str(page_no)))
+        return urllib.parse.urlunsplit(split_url._replace(query=urllib.parse.urlencode(query)))
+    
+    def iter_pages(self, url, params=None, concurrency=None, first_page=None):
+        concurrency = concurrency or self.page_concurrency
+        data = first_page or self.get(url, params=params)
+        yield data
+        next_page = data.get('hydra:nextPage')
+        num_pages = self.get_page_count(data)
+        
+        if next_page and num_pages and concurrency > 1:
+            # Fetch the remaining pages at the same time, but only a few pages ahead
+            # of the consumer so memory usage stays flat no matter how many pages there are
+            pending = deque()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for page_no in range(2, num_pages + 1):
+                    pending.append(executor.submit(self.get, self.get_page_url(next_page, page_no), params=params))
+                    if len(pending) >= 2 * concurrency:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            return
+        
         while next_page:
             data = self.get(next_page, params=params)
-            result.extend(data['hydra:member'])
+            yield data
             next_page = data.get('hydra:nextPage')
-        return result
+    
+    def iter_paged(self, url, params=None, concurrency=None):
+        return PagedCollection(self, url, params, concurrency)
+    
+    def get_paged(self, url, params=None, concurrency=None):
+        return list(self.iter_paged(url, params, concurrency))
     
     def get_parts(self, filter=None):
+        return list(self.iter_parts(filter))
+    
+    def iter_parts(self, filter=None):
         if filter:
             params = {'filter': json.dumps([filter])}
         else:
             params = None
-        return self.get_paged("/api/parts", params=params)
+        return self.iter_paged("/api/parts", params=params)
     
     def get_part(self, part_id):
         return self.get("/api/parts/{}".format(part_id))
@@ -106,19 +201,43 @@ class PartKeepr:
     def part_set_stock(self, part_id, quantity):
         return self.update(part_id + "/setStock", {'quantity': quantity})
     
-    def update_part_data(self, part, part_data, distributor, manufacturer_ids_by_name=None):
-        if not manufacturer_ids_by_name:
-            print("Getting manufacturers")
-            manufacturers = self.get_manufacturers()
-            manufacturer_ids_by_name = dict([(mf['name'].lower(), mf['@id']) for mf in manufacturers])
+    def part_change_stock(self, part_id, action, quantity):
+        # Like part_add_stock, part_remove_stock and part_set_stock for action ADD, SUB or SET,
+        # but returns the response so callers can tell temporary server errors from rejected changes
+        url = part_id + {"ADD": "/addStock", "SUB": "/removeStock", "SET": "/setStock"}[action]
+        response = self.session.put(self.base_url + url, json={'quantity': quantity}, timeout=self.timeout)
+        if response.ok:
+            try:
+                self.notify_write(url, response.json())
+            except ValueError:
+                # The change was made even though the response isn't the expected JSON
+                pass
+        return response
+    
+    def plan_part_update(self, part, part_data, distributor, update=None):
+        # Work out the writes needed to bring a part in line with the distributor data without sending anything.
+        # Pass the result of a previous call as update to merge the data of several distributors into one update.
+        if update is None:
+            update = {
+                'part': copy.deepcopy(part),
+                'part_manufacturers': [],
+                'new_part_manufacturers': [],
+                'part_distributors': [],
+                'photo': None,
+                'part_changed': False,
+                'skipped': []
+            }
+        part = update['part']
+        distributor = next((d for d in part['distributors'] if d.get('@id') == distributor.get('@id')), distributor)
         
         part_manufacturers = part['manufacturers']
-        part_manufacturer_ids_by_name = dict([(mf['manufacturer']['name'].lower(), mf['@id']) for mf in part_manufacturers]) 
+        part_manufacturer_ids_by_name = dict([(mf['manufacturer']['name'].lower(), mf['@id']) for mf in part_manufacturers if 'manufacturer' in mf])
         
         # Update description
-        if part_data['description']:
+        if part_data['description'] and part_data['description'] != part['description']:
             print("        Updating description")
             part['description'] = part_data['description']
+            update['part_changed'] = True
         
         # Update manufacturer data if available
         if part_data['manufacturer']:
@@ -127,61 +246,195 @@ class PartKeepr:
                 print("        Found part manufacturer entry")
                 part_mf_id = part_manufacturer_ids_by_name[part_data['manufacturer'].lower()]
                 for mf in part_manufacturers:
-                    if mf['@id'] == part_mf_id:
-                        print("        Updating part manufacturer entry")
+                    if mf['@id'] != part_mf_id:
+                        continue
+                    if mf['partNumber'] == part_data['manufacturer_part_no']:
+                        update['skipped'].append('part_manufacturer')
+                    else:
                         mf['partNumber'] = part_data['manufacturer_part_no']
-                        result = self.update_part_manufacturer(mf)
+                        update['part_changed'] = True
+                        if mf not in update['part_manufacturers']:
+                            update['part_manufacturers'].append(mf)
             else:
-                if part_data['manufacturer'].lower() in manufacturer_ids_by_name:
-                    print("        Found manufacturer in database")
-                    mf_id = manufacturer_ids_by_name[part_data['manufacturer'].lower()]
+                for new_mf in update['new_part_manufacturers']:
+                    if new_mf['name'].lower() == part_data['manufacturer'].lower():
+                        new_mf['partNumber'] = part_data['manufacturer_part_no']
+                        break
                 else:
-                    print("        Creating manufacturer entry")
-                    mf_new = {'name': part_data['manufacturer']}
-                    result = self.create_manufacturer(mf_new)
-                    mf_id = result['@id']
-                    manufacturer_ids_by_name[part_data['manufacturer'].lower()] = mf_id
-                print("        Creating part manufacturer entry")
-                part_mf_new = {'manufacturer': {'@id': mf_id}, 'partNumber': part_data['manufacturer_part_no']}
-                result = self.create_part_manufacturer(part_mf_new)
-                part_mf_id = result['@id']
-                print("        Linking part manufacturer to part")
-                part['manufacturers'].append({'@id': part_mf_id})
+                    update['new_part_manufacturers'].append({'name': part_data['manufacturer'], 'partNumber': part_data['manufacturer_part_no']})
+                update['part_changed'] = True
         else:
             print("        No manufacturer found!")
         
         # Update pricing data
         if part_data['prices']:
             new_price = part_data['prices'][0]['price'] # Always use lowest quantity group
-            print("        Updating price from {} to {:.5f}".format(distributor['price'], new_price))
-            distributor['price'] = new_price
-            result = self.update_part_distributor(distributor)
+            # PartKeepr stores prices with 5 decimals
+            if round(float(distributor['price'] or 0), 5) == round(float(new_price), 5):
+                update['skipped'].append('part_distributor')
+            else:
+                print("        Updating price from {} to {:.5f}".format(distributor['price'], new_price))
+                distributor['price'] = new_price
+                if distributor not in update['part_distributors']:
+                    update['part_distributors'].append(distributor)
         
         # Update image if no image attachment is present and distributor has a photo
-        if not [a['isImage'] for a in part['attachments']] and part_data['photo']:
-            print("        Updating photo")
-            if isinstance(part_data['photo'], io.IOBase):
-                result = self.upload_temp_file(part_data['photo'])
-                part_data['photo'].close()
-                os.remove(part_data['photo'].name)
-            else:
-                result = self.upload_temp_file_from_url(part_data['photo'])
-            file_id = result['image']['@id']
-            part['attachments'].append({'@id': file_id})
+        if not [a['isImage'] for a in part['attachments']] and part_data['photo'] and not update['photo']:
+            update['photo'] = part_data['photo']
+            update['part_changed'] = True
         
         # Update parameters
         # For now, all parameters are treated as text and the PartKeepr Unit system is not used.
         if part_data['parameters']:
-            print("        Updating parameters")
             for param_name, param_value in part_data['parameters'].items():
                 param_found = False
                 for j, existing_param in enumerate(part['parameters']):
                     if existing_param['name'] == param_name:
-                        part['parameters'][j]['stringValue'] = param_value
+                        if existing_param['stringValue'] != param_value:
+                            print("        Updating parameter {}".format(param_name))
+                            part['parameters'][j]['stringValue'] = param_value
+                            update['part_changed'] = True
                         param_found = True
                         break
                 if not param_found:
+                    print("        Adding parameter {}".format(param_name))
                     part['parameters'].append({'name': param_name, 'stringValue': param_value})
+                    update['part_changed'] = True
+        
+        return update
+    
+    def count_writes(self, performed=(), skipped=()):
+        with self.stats_lock:
+            self.writes_performed.update(performed)
+            self.writes_skipped.update(skipped)
+    
+    def print_write_summary(self):
+        print("Writes performed: {}".format(", ".join(["{} {}".format(n, kind) for kind, n in sorted(self.writes_performed.items())]) or "none"))
+        print("Writes skipped (unchanged): {}".format(", ".join(["{} {}".format(n, kind) for kind, n in sorted(self.writes_skipped.items())]) or "none"))
+    
+    def apply_part_update(self, update, manufacturer_ids_by_name=None):
+        # Send the writes planned by plan_part_update, returns the updated part
+        part = update['part']
+        self.count_writes(skipped=update['skipped'])
+        
+        for mf in update['part_manufacturers']:
+            print("        Updating part manufacturer entry")
+            result = self.update_part_manufacturer(mf)
+            self.count_writes(performed=['part_manufacturer'])
+        
+        if update['new_part_manufacturers'] and not manufacturer_ids_by_name:
+            print("Getting manufacturers")
+            manufacturers = self.get_manufacturers()
+            manufacturer_ids_by_name = dict([(mf['name'].lower(), mf['@id']) for mf in manufacturers])
+        
+        for new_mf in update['new_part_manufacturers']:
+            # Several parts may introduce the same new manufacturer at the same time
+            with self.manufacturer_lock:
+                if new_mf['name'].lower() in manufacturer_ids_by_name:
+                    print("        Found manufacturer in database")
+                    mf_id = manufacturer_ids_by_name[new_mf['name'].lower()]
+                else:
+                    print("        Creating manufacturer entry")
+                    mf_new = {'name': new_mf['name']}
+                    result = self.create_manufacturer(mf_new)
+                    self.count_writes(performed=['manufacturer'])
+                    mf_id = result['@id']
+                    manufacturer_ids_by_name[new_mf['name'].lower()] = mf_id
+            print("        Creating part manufacturer entry")
+            part_mf_new = {'manufacturer': {'@id': mf_id}, 'partNumber': new_mf['partNumber']}
+            result = self.create_part_manufacturer(part_mf_new)
+            self.count_writes(performed=['part_manufacturer'])
+            part_mf_id = result['@id']
+            print("        Linking part manufacturer to part")
+            part['manufacturers'].append({'@id': part_mf_id})
+        
+        for distributor in update['part_distributors']:
+            result = self.update_part_distributor(distributor)
+            self.count_writes(performed=['part_distributor'])
+        
+        if update['photo']:
+            print("        Updating photo")
+            file_id = self.upload_photo(update['photo'])
+            if file_id:
+                part['attachments'].append({'@id': file_id})
+        
+        if not update['part_changed']:
+            # Nothing but the price changed, which lives in the part distributor
+            print("        Part unchanged, skipping part update")
+            self.count_writes(skipped=['part'])
+            return part
         
         # Update part in database
+        self.count_writes(performed=['part'])
         return self.update_part(part)
+    
+    def get_photo_key(self, photo):
+        # Downloaded photos are identified by their content, the others by URL
+        if isinstance(photo, tuple):
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: photo[1].read(64 * 1024), b""):
+                digest.update(chunk)
+            photo[1].seek(0)
+            return "sha256:" + digest.hexdigest()
+        return "url:" + photo
+    
+    def is_photo(self, file):
+        # PartKeepr may have fetched an error page instead of a photo
+        return '@id' in file and file.get('mimetype', "image/").startswith("image/")
+    
+    def get_indexed_photo(self, key):
+        # Only reuse uploads the server still has and that are photos
+        file_id = self.photo_index.get(key)
+        if file_id and self.is_photo(self.get(file_id)):
+            print("        Reusing uploaded photo {}".format(file_id))
+            return file_id
+        if file_id:
+            self.photo_index.remove(file_id)
+        return None
+    
+    def upload_photo(self, photo):
+        # photo is a URL, a downloaded photo (see download_photo) or a PhotoDownload,
+        # returns the ID of the uploaded file or None if the photo could not be uploaded
+        keys = []
+        if isinstance(photo, PhotoDownload):
+            # Photos we download ourselves are also remembered by URL, so they are only downloaded once
+            if self.photo_index:
+                keys.append("url:" + photo.url)
+                file_id = self.get_indexed_photo(keys[-1])
+                if file_id:
+                    return file_id
+            try:
+                photo = photo.download()
+            except (requests.RequestException, ValueError) as e:
+                print("        Failed to download photo: {}".format(e))
+                return None
+        
+        if self.photo_index:
+            keys.append(self.get_photo_key(photo))
+            file_id = self.get_indexed_photo(keys[-1])
+            if file_id:
+                if isinstance(photo, tuple):
+                    photo[1].close()
+                for key in keys:
+                    self.photo_index.put(key, file_id)
+                return file_id
+        
+        if isinstance(photo, tuple):
+            result = self.upload_temp_file(photo)
+            photo[1].close()
+        else:
+            result = self.upload_temp_file_from_url(photo)
+        image = result.get('image') or {}
+        # A failed upload must not be attached, let alone recorded in the index and reused for other parts
+        if not self.is_photo(image):
+            print("        Failed to upload photo: {}".format(result))
+            return None
+        file_id = image['@id']
+        self.count_writes(performed=['photo'])
+        for key in keys:
+            self.photo_index.put(key, file_id)
+        return file_id
+    
+    def update_part_data(self, part, part_data, distributor, manufacturer_ids_by_name=None):
+        update = self.plan_part_update(part, part_data, distributor)
+        return self.apply_part_update(update, manufacturer_ids_by_name)
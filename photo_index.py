@@ -0,0 +1,28 @@
+import sqlite3
+import threading
+
+
+class PhotoIndex:
+    # Remembers which PartKeepr upload a photo went to, by photo URL and by content hash,
+    # so parts sharing a distributor stock photo reuse one upload instead of each uploading it again.
+    # Kept in SQLite so it persists across sync runs.
+    
+    def __init__(self, path=".photo_index"):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS photos (key TEXT PRIMARY KEY, file_id TEXT)")
+    
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT file_id FROM photos WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def put(self, key, file_id):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO photos VALUES (?, ?)", (key, file_id))
+    
+    def remove(self, file_id):
+        # Forget an upload that no longer exists on the server
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM photos WHERE file_id = ?", (file_id,))
@@ -0,0 +1,59 @@
+import threading
+import time
+
+
+class RateLimiter:
+    # Token bucket shared by every thread calling the same distributor API.
+    # When the API reports that we are too fast, the rate is halved and slowly
+    # raised back to the configured rate with every successful call.
+    
+    def __init__(self, rate, burst=1, max_retries=5):
+        # rate is in calls per second, burst is the number of calls that may be made back to back
+        self.rate = rate
+        self.current_rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.current_rate)
+                self.last_refill = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.current_rate)
+            time.sleep(delay)
+    
+    def throttle(self, retry_after=None):
+        with self.lock:
+            self.current_rate = max(self.rate / 32, self.current_rate / 2)
+            self.tokens = 0
+            delay = retry_after if retry_after is not None else 1 / self.current_rate
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+    
+    def recover(self):
+        with self.lock:
+            self.current_rate = min(self.rate, self.current_rate + self.rate / 16)
+    
+    def request(self, func, *args, is_limited=None, **kwargs):
+        # Call a requests function like requests.get under the rate limit, retrying if the API
+        # answers with HTTP 429 or is_limited(response) reports a quota error
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            response = func(*args, **kwargs)
+            limited = response.status_code == 429 or (is_limited is not None and is_limited(response))
+            if not limited:
+                self.recover()
+                return response
+            if attempt == self.max_retries:
+                return response
+            retry_after = response.headers.get('Retry-After')
+            retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+            self.throttle(retry_after)
+            print("        Rate limited by API, backing off to {:.2f} calls per second".format(self.current_rate))
@@ -0,0 +1,51 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    # Persistent cache of distributor responses keyed by distributor, order number and kind of data.
+    # Kept in SQLite so several processes (sync runs, the barcode client) share it.
+    # Every kind of data has its own TTL: descriptions, parameters and photos rarely change,
+    # prices do. When the cache is full, the least recently used entries are evicted first,
+    # with entries that cost more API calls to refetch kept a little longer.
+    
+    DEFAULT_TTLS = {
+        'info': 30 * 24 * 3600,
+        'prices': 24 * 3600
+    }
+    
+    # Seconds of extra lifetime in the LRU order per API call an entry saves
+    COST_WEIGHT = 3600
+    
+    def __init__(self, path=".distributor_cache", max_entries=100000, ttls=None):
+        self.max_entries = max_entries
+        self.ttls = dict(self.DEFAULT_TTLS, **(ttls or {}))
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (distributor TEXT, order_no TEXT, kind TEXT, data TEXT, stored REAL, last_access REAL, cost INTEGER, PRIMARY KEY (distributor, order_no, kind))")
+    
+    def get(self, distributor, order_no, kind):
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT data FROM entries WHERE distributor = ? AND order_no = ? AND kind = ? AND stored > ?", (distributor, order_no, kind, now - self.ttls[kind])).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE entries SET last_access = ? WHERE distributor = ? AND order_no = ? AND kind = ?", (now, distributor, order_no, kind))
+        return json.loads(row[0])
+    
+    def put(self, distributor, order_no, kind, data, cost=1):
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", (distributor, order_no, kind, json.dumps(data), now, now, cost))
+            self.evict(now)
+    
+    def evict(self, now):
+        num_entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if num_entries <= self.max_entries:
+            return
+        for kind, ttl in self.ttls.items():
+            self.db.execute("DELETE FROM entries WHERE kind = ? AND stored <= ?", (kind, now - ttl))
+        self.db.execute("DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries ORDER BY last_access + cost * ? LIMIT MAX(0, (SELECT COUNT(*) FROM entries) - ?))", (self.COST_WEIGHT, self.max_entries))
@@ -0,0 +1,111 @@
+import requests
+import sqlite3
+import threading
+import time
+
+
+class StockQueue:
+    # Durable write-ahead queue of stock changes. Changes are committed to SQLite first,
+    # so they survive the PartKeepr server being slow or down and the client being restarted,
+    # and a background flusher sends them to PartKeepr in the order they were made.
+    # Connection problems, timeouts and server errors (5xx, 429) are retried with backoff and hold up
+    # the changes queued after them; changes PartKeepr rejects (other 4xx) or that fail with any other error
+    # are marked as failed and kept in the queue file for inspection.
+    
+    ACTIONS = ("ADD", "SUB", "SET")
+    
+    def __init__(self, pk, path=".stock_queue", max_retry_delay=60):
+        self.pk = pk
+        self.max_retry_delay = max_retry_delay
+        self.lock = threading.Lock()
+        self.queued = threading.Condition(self.lock)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS operations (id INTEGER PRIMARY KEY AUTOINCREMENT, part_id TEXT, action TEXT, quantity INTEGER, created REAL, attempts INTEGER DEFAULT 0, failed INTEGER DEFAULT 0, error TEXT)")
+    
+    def count(self, failed=False):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM operations WHERE failed = ?", (int(failed),)).fetchone()[0]
+    
+    def get_expected_stock(self, part_id, stock_level):
+        # Stock level of the part once the changes still queued for it are sent,
+        # and the number of those changes
+        with self.lock:
+            rows = self.db.execute("SELECT action, quantity FROM operations WHERE part_id = ? AND failed = 0 ORDER BY id", (part_id,)).fetchall()
+        for action, quantity in rows:
+            if action == "ADD":
+                stock_level += quantity
+            elif action == "SUB":
+                stock_level -= quantity
+            else:
+                stock_level = quantity
+        return stock_level, len(rows)
+    
+    def enqueue(self, part_id, action, quantity):
+        if action not in self.ACTIONS:
+            raise ValueError("Unknown stock action: {}".format(action))
+        with self.lock:
+            with self.db:
+                self.db.execute("INSERT INTO operations (part_id, action, quantity, created) VALUES (?, ?, ?, ?)", (part_id, action, quantity, time.time()))
+            self.queued.notify()
+    
+    def next_operation(self):
+        # Blocks until there is an operation to send
+        with self.lock:
+            while True:
+                row = self.db.execute("SELECT id, part_id, action, quantity FROM operations WHERE failed = 0 ORDER BY id LIMIT 1").fetchone()
+                if row:
+                    return row
+                self.queued.wait()
+    
+    def send(self, part_id, action, quantity):
+        return self.pk.part_change_stock(part_id, action, quantity)
+    
+    def flush_loop(self):
+        retry_delay = 1
+        while True:
+            op_id, part_id, action, quantity = self.next_operation()
+            try:
+                response = self.send(part_id, action, quantity)
+                if response.status_code >= 500 or response.status_code == 429:
+                    # The server is overloaded or has trouble of its own, e.g. with its database
+                    error = "HTTP {}: {}".format(response.status_code, response.text[:200])
+                else:
+                    error = None
+            except requests.RequestException as e:
+                # Connection errors and timeouts
+                error = e
+            except Exception as e:
+                # Anything else is not going to go away by retrying, so the change is set aside
+                # instead of ending the flusher and holding up all changes queued after it
+                print("Stock queue: {} {} {} failed: {!r}".format(action, quantity, part_id, e))
+                self.mark_failed(op_id, e)
+                continue
+            
+            if error:
+                print("Stock queue: {} {} {} failed, retrying in {} s: {}".format(action, quantity, part_id, retry_delay, error))
+                with self.lock, self.db:
+                    self.db.execute("UPDATE operations SET attempts = attempts + 1, error = ? WHERE id = ?", (str(error), op_id))
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                continue
+            retry_delay = 1
+            
+            if response.ok:
+                try:
+                    stock_level = response.json().get('stockLevel')
+                except ValueError:
+                    stock_level = None
+                print("Stock queue: {} {} {}, new stock level: {}".format(action, quantity, part_id, stock_level))
+                with self.lock, self.db:
+                    self.db.execute("DELETE FROM operations WHERE id = ?", (op_id,))
+            else:
+                print("Stock queue: {} {} {} rejected by PartKeepr: HTTP {}: {}".format(action, quantity, part_id, response.status_code, response.text[:200]))
+                self.mark_failed(op_id, "HTTP {}: {}".format(response.status_code, response.text))
+    
+    def mark_failed(self, op_id, error):
+        with self.lock, self.db:
+            self.db.execute("UPDATE operations SET attempts = attempts + 1, failed = 1, error = ? WHERE id = ?", (str(error), op_id))
+    
+    def start(self):
+        threading.Thread(target=self.flush_loop, daemon=True).start()
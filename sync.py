@@ -0,0 +1,224 @@
+import os
+import queue
+import threading
+import traceback
+
+from distributor_common import SUPPORTED_DISTRIBUTORS, get_part_data, get_parts_data
+
+
+# Marks the end of the input of a pipeline stage
+STOP = object()
+
+
+class SyncJournal:
+    # Append-only checkpoint journal of a sync run. Every part is recorded when it is queued
+    # and again once its update is committed, so an interrupted run can be resumed by part ID.
+    # Lines are "plan <part id>", "done <part id>" and "complete" once all parts are queued.
+    
+    def __init__(self, path):
+        self.path = path
+        self.planned = []
+        self.done = set()
+        self.complete = False
+        self.lock = threading.Lock()
+        self.file = None
+    
+    def load(self):
+        # Returns False if there is no journal to resume from
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    entry, _, part_id = line.strip().partition(" ")
+                    if entry == "plan":
+                        self.planned.append(part_id)
+                    elif entry == "done":
+                        self.done.add(part_id)
+                    elif entry == "complete":
+                        self.complete = True
+        except FileNotFoundError:
+            return False
+        self.file = open(self.path, 'a')
+        return True
+    
+    def start(self):
+        self.file = open(self.path, 'w')
+    
+    def remaining(self):
+        return [part_id for part_id in dict.fromkeys(self.planned) if part_id not in self.done]
+    
+    def record(self, entry, part_id=None):
+        with self.lock:
+            self.file.write("{} {}\n".format(entry, part_id) if part_id else entry + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+    
+    def close(self):
+        self.file.close()
+
+
+class SyncPipeline:
+    # Syncs parts with distributor data in three stages that run at the same time:
+    # fetching distributor data, planning the PartKeepr writes and sending them.
+    # Each stage has its own pool of worker threads, connected by bounded queues.
+    # The distributor clients throttle themselves, so fetch workers only wait for their rate limits.
+    # In front of the fetch stage, the TME data of a whole batch of parts is queried at once,
+    # after which the parts are fetched one by one like all others.
+    
+    def __init__(self, pk, tme, mouser, digikey, lcsc, manufacturer_ids_by_name, cache=None, prefetch_workers=2, fetch_workers=8, plan_workers=1, write_workers=2, batch_size=50, queue_size=16, journal=None, reload_parts=False):
+        self.pk = pk
+        self.tme = tme
+        self.mouser = mouser
+        self.digikey = digikey
+        self.lcsc = lcsc
+        self.cache = cache
+        self.manufacturer_ids_by_name = manufacturer_ids_by_name
+        self.prefetch_workers = prefetch_workers
+        self.fetch_workers = fetch_workers
+        self.plan_workers = plan_workers
+        self.write_workers = write_workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.journal = journal
+        # Parts from the local catalog may be outdated, so they are read from PartKeepr again
+        # before their update is planned, to not overwrite edits made since the last refresh
+        self.reload_parts = reload_parts
+        self.errors = []
+    
+    def prefetch(self, jobs):
+        # Gets the data of all TME parts of a batch with as few calls as possible,
+        # then hands the parts on to the fetch stage one by one
+        tme_order_nos = [d['orderNumber'] for job in jobs for d in job['part']['distributors'] if d['distributor']['name'] == "TME"]
+        tme_parts_data = None
+        if len(tme_order_nos) > 1:
+            print("    Getting TME data for {} parts".format(len(tme_order_nos)))
+            try:
+                tme_parts_data = get_parts_data("TME", tme_order_nos, self.tme, self.mouser, self.digikey, self.lcsc, self.cache)
+            except Exception:
+                # The parts will query TME one by one instead
+                traceback.print_exc()
+        for job in jobs:
+            job['tme_parts_data'] = tme_parts_data
+        return jobs
+    
+    def fetch(self, job):
+        tme_parts_data = job.pop('tme_parts_data', None)
+        if self.reload_parts:
+            part = self.pk.get_part(job['part']['@id'].split("/")[-1])
+            if '@id' not in part:
+                print("    {}: Failed to get part!".format(job['part']['name']))
+                self.errors.append(job['part']['name'])
+                return None
+            job['part'] = part
+        part = job['part']
+        print("  [{: 5d}/{: 5d}] Processing {}".format(job['index']+1, job['num_parts'], part['name']))
+        
+        fetched = []
+        for distributor in part['distributors']:
+            distributor_name = distributor['distributor']['name']
+            if distributor_name not in SUPPORTED_DISTRIBUTORS.values():
+                print("    {}: Skipping distributor {}".format(part['name'], distributor_name))
+                continue
+            
+            print("    {}: Processing distributor {}".format(part['name'], distributor_name))
+            if distributor_name == "TME" and tme_parts_data and distributor['orderNumber'] in tme_parts_data:
+                part_data = tme_parts_data[distributor['orderNumber']]
+            else:
+                # Other distributors, and TME parts missing from the batch data because their chunk failed
+                # or the part was reloaded with another order number
+                part_data = get_part_data(distributor_name, distributor['orderNumber'], self.tme, self.mouser, self.digikey, self.lcsc, self.cache)
+            if not part_data:
+                print("      {}: Failed to get part data!".format(part['name']))
+                self.errors.append(part['name'])
+                job['failed'] = True
+                continue
+            fetched.append((distributor, part_data))
+        
+        if not fetched:
+            if not job.get('failed'):
+                self.commit(job)
+            return None
+        job['fetched'] = fetched
+        return job
+    
+    def plan(self, job):
+        print("    {}: Planning update".format(job['part']['name']))
+        update = None
+        for distributor, part_data in job['fetched']:
+            update = self.pk.plan_part_update(job['part'], part_data, distributor, update)
+        job['update'] = update
+        return job
+    
+    def write(self, job):
+        print("    {}: Writing update".format(job['part']['name']))
+        part = self.pk.apply_part_update(job['update'], self.manufacturer_ids_by_name)
+        if '@id' not in part:
+            print("      {}: Failed to update part!".format(job['part']['name']))
+            self.errors.append(job['part']['name'])
+        elif not job.get('failed'):
+            self.commit(job)
+        return None
+    
+    def commit(self, job):
+        # Parts with errors are left out of the journal so a resumed run tries them again
+        if self.journal:
+            self.journal.record("done", job['part']['@id'])
+    
+    def worker(self, func, in_queue, out_queue):
+        while True:
+            job = in_queue.get()
+            if job is STOP:
+                return
+            try:
+                result = func(job)
+            except Exception:
+                traceback.print_exc()
+                for failed_job in (job if isinstance(job, list) else [job]):
+                    self.errors.append(failed_job['part']['name'])
+                continue
+            if result is None or out_queue is None:
+                continue
+            # The prefetch stage takes batches of parts, but hands parts on one by one
+            for next_job in (result if isinstance(result, list) else [result]):
+                out_queue.put(next_job)
+    
+    def start_stage(self, func, in_queue, out_queue, num_workers):
+        threads = [threading.Thread(target=self.worker, args=(func, in_queue, out_queue), daemon=True) for i in range(num_workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+    
+    def stop_stage(self, in_queue, threads):
+        for thread in threads:
+            in_queue.put(STOP)
+        for thread in threads:
+            thread.join()
+    
+    def run(self, parts, num_parts, start=0):
+        batch_queue = queue.Queue(self.queue_size)
+        fetch_queue = queue.Queue(self.queue_size)
+        plan_queue = queue.Queue(self.queue_size)
+        write_queue = queue.Queue(self.queue_size)
+        prefetchers = self.start_stage(self.prefetch, batch_queue, fetch_queue, self.prefetch_workers)
+        fetchers = self.start_stage(self.fetch, fetch_queue, plan_queue, self.fetch_workers)
+        planners = self.start_stage(self.plan, plan_queue, write_queue, self.plan_workers)
+        writers = self.start_stage(self.write, write_queue, None, self.write_workers)
+        
+        batch = []
+        for i, part in enumerate(parts, start):
+            if self.journal:
+                self.journal.record("plan", part['@id'])
+            batch.append({'index': i, 'num_parts': num_parts, 'part': part})
+            if len(batch) >= self.batch_size:
+                batch_queue.put(batch)
+                batch = []
+        if batch:
+            batch_queue.put(batch)
+        if self.journal:
+            self.journal.record("complete")
+        
+        # Shut down the stages in order so every item makes it through the whole pipeline
+        self.stop_stage(batch_queue, prefetchers)
+        self.stop_stage(fetch_queue, fetchers)
+        self.stop_stage(plan_queue, planners)
+        self.stop_stage(write_queue, writers)
+        return self.errors
@@ -1,16 +1,33 @@
 import base64
 import hmac
-import requests
 import urllib.parse
 
 from hashlib import sha1
 
+from distributor_common import DEFAULT_TIMEOUT, create_session
+from ratelimit import RateLimiter
+
 
 class TME:
-    def __init__(self, app_key, app_secret):
+    # Maximum number of symbols the API accepts in one SymbolList
+    MAX_SYMBOLS = 50
+    
+    # Statuses the API answers with when we are too fast or over the quota
+    LIMITED_STATUSES = ("E_TOO_MANY_REQUESTS", "E_SERVICE_TEMPORARILY_UNAVAILABLE")
+    
+    def __init__(self, app_key, app_secret, rate_limit=5, pool_size=10, timeout=DEFAULT_TIMEOUT):
         self.base_url = "https://api.tme.eu"
         self.app_key = app_key
         self.app_secret = app_secret
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.session = create_session(pool_size)
+        self.timeout = timeout
+    
+    def is_rate_limited(self, response):
+        try:
+            return response.json().get('Status') in self.LIMITED_STATUSES
+        except ValueError:
+            return False
     
     def calculate_signature(self, method, url, params):
         sorted_params = sorted(list(params.items()))
@@ -24,7 +41,25 @@ class TME:
         params['Token'] = self.app_key
         signature = self.calculate_signature("POST", full_url, params)
         params['ApiSignature'] = signature
-        return requests.post(full_url, data=params).json()
+        return self.rate_limiter.request(self.session.post, full_url, data=params, timeout=self.timeout, is_limited=self.is_rate_limited).json()
+    
+    def batch_api_call(self, url, params, order_nos):
+        # Query the API for many symbols at once, split into chunks the API accepts.
+        # Returns the product list entries keyed by the requested order number.
+        results = {}
+        for i in range(0, len(order_nos), self.MAX_SYMBOLS):
+            chunk = order_nos[i:i+self.MAX_SYMBOLS]
+            chunk_params = dict(params)
+            for j, order_no in enumerate(chunk):
+                chunk_params["SymbolList[{}]".format(j)] = order_no
+            data = self.api_call(url, chunk_params)
+            if 'Error' in data:
+                print("        TME API Error: {}".format(data['Status']))
+                continue
+            order_nos_by_symbol = dict([(order_no.upper(), order_no) for order_no in chunk])
+            for product in data['Data']['ProductList']:
+                results[order_nos_by_symbol.get(product['Symbol'].upper(), product['Symbol'])] = product
+        return results
     
     def get_part_details(self, order_no):
         data = self.api_call("/Products/GetProducts.json", {"Country": "DE", "Language": "EN", "SymbolList[0]": order_no})
@@ -37,3 +72,12 @@ class TME:
     def get_part_parameters(self, order_no):
         data = self.api_call("/Products/GetParameters.json", {"Country": "DE", "Language": "EN", "SymbolList[0]": order_no})
         return data
+    
+    def get_parts_details(self, order_nos):
+        return self.batch_api_call("/Products/GetProducts.json", {"Country": "DE", "Language": "EN"}, order_nos)
+    
+    def get_parts_prices(self, order_nos):
+        return self.batch_api_call("/Products/GetPrices.json", {"Country": "DE", "Language": "EN", "Currency": "EUR", "GrossPrices": "true"}, order_nos)
+    
+    def get_parts_parameters(self, order_nos):
+        return self.batch_api_call("/Products/GetParameters.json", {"Country": "DE", "Language": "EN"}, order_nos)
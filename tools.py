@@ -1,10 +1,9 @@
 import argparse
-import code128
 import csv
-import time
+import itertools
+import os
 
 from collections import defaultdict
-from PIL import Image, ImageDraw, ImageFont
 from pprint import pprint
 
 from secrets import *
@@ -13,7 +12,19 @@ from mouser import Mouser
 from digikey import DigiKey
 from lcsc import LCSC
 from partkeepr import PartKeepr
-from distributor_common import SUPPORTED_DISTRIBUTORS, get_part_data
+from catalog import PartCatalog
+from response_cache import ResponseCache
+from photo_index import PhotoIndex
+from sync import SyncJournal, SyncPipeline
+from labels import get_label_entry, get_label_hash, load_label_manifest, render_labels, save_label_manifest, save_labels_pdf, save_labels_vector_pdf
+
+
+def get_current_part(pk, source, part):
+    # Parts read from the local catalog may be outdated, so they are read again
+    # before a whole part is written back, to not overwrite edits made since the last refresh
+    if source is pk:
+        return part
+    return pk.get_part(part['@id'].split("/")[-1])
 
 
 def main():
@@ -21,6 +32,8 @@ def main():
     parser.add_argument("-a", "--action", type=str, required=True, choices=('sync-distributors', 'list-empty-part-mf', 'update-locations-from-csv', 'generate-labels', 'rename-from-params', 'update-project-from-csv', 'check-stock-from-csv'), help="Which action to perform")
     parser.add_argument("-f", "--force", action='store_true', help="Force certain actions")
     parser.add_argument("-o", "--offset", type=int, required=False, help="Offset into parts list (how many parts to skip)")
+    parser.add_argument("--resume", action='store_true', help="For distributor sync: Resume an interrupted sync from its journal")
+    parser.add_argument("--journal", type=str, required=False, default=".sync_journal", help="For distributor sync: Checkpoint journal file name")
     parser.add_argument("--id", type=int, required=False, help="Single part ID")
     parser.add_argument("--location", type=str, required=False, help="Single storage location name")
     parser.add_argument("--name-column", type=str, required=False, help="For CSV import: Name column name")
@@ -36,55 +49,83 @@ def main():
     parser.add_argument("--font-size", type=int, required=False, help="For label generation: Font size")
     parser.add_argument("--max-parts-per-label", type=int, required=False, help="For label generation: Only generate label for maximum of n parts")
     parser.add_argument("--label-file", type=str, required=False, help="For label generation: Label PDF file name")
+    parser.add_argument("--label-format", type=str, required=False, default="raster", choices=["raster", "vector"], help="For label generation: Embed labels as images or draw them as vector graphics")
+    parser.add_argument("--changed-only", action="store_true", help="For label generation: Only generate labels of storage locations whose parts changed since the last run")
+    parser.add_argument("--label-manifest", type=str, required=False, default=".label_manifest", help="For label generation: File remembering the content of generated labels")
+    parser.add_argument("--render-workers", type=int, required=False, default=os.cpu_count(), help="For label generation: Number of processes rendering labels")
     parser.add_argument("--project-id", type=int, required=False, help="For project CSV import: Internal project ID (integer)")
     parser.add_argument("--num-boards", type=int, required=False, help="For stock check: Desired number of boards")
+    parser.add_argument("--page-concurrency", type=int, required=False, default=4, help="Number of parts list pages to fetch at the same time")
+    parser.add_argument("--fetch-workers", type=int, required=False, default=8, help="For distributor sync: Number of parts to fetch distributor data for at the same time")
+    parser.add_argument("--rate-limit", type=str, action='append', required=False, help="Distributor API rate limit in calls per second, e.g. TME=5 (can be given multiple times)")
+    parser.add_argument("--write-workers", type=int, required=False, default=2, help="For distributor sync: Number of parts to write back to PartKeepr at the same time")
+    parser.add_argument("--distributor-cache", type=str, required=False, default=".distributor_cache", help="File to cache distributor responses in (empty to disable)")
+    parser.add_argument("--price-max-age", type=int, required=False, default=24*3600, help="Refetch cached distributor prices older than this many seconds")
+    parser.add_argument("--photo-index", type=str, required=False, default=".photo_index", help="File remembering uploaded photos so they are reused (empty to disable)")
+    parser.add_argument("--catalog", type=str, required=False, help="Serve reads from a local catalog cache in this file")
+    parser.add_argument("--catalog-max-age", type=int, required=False, default=3600, help="Refresh the local catalog cache if it is older than this many seconds")
     args = parser.parse_args()
     
-    pk = PartKeepr(PK_BASE_URL, PK_USERNAME, PK_PASSWORD)
-    tme = TME(TME_APP_KEY, TME_APP_SECRET)
-    mouser = Mouser(MOUSER_API_KEY)
-    digikey = DigiKey(DIGIKEY_CLIENT_ID, DIGIKEY_CLIENT_SECRET)
-    lcsc = LCSC()
+    pk = PartKeepr(PK_BASE_URL, PK_USERNAME, PK_PASSWORD, page_concurrency=args.page_concurrency)
+    rate_limits = dict([(limit.split("=")[0], float(limit.split("=")[1])) for limit in args.rate_limit or []])
+    # Every fetch worker may talk to the same distributor at once, so size the connection pools to match
+    tme = TME(TME_APP_KEY, TME_APP_SECRET, rate_limit=rate_limits.get("TME", 5), pool_size=args.fetch_workers)
+    mouser = Mouser(MOUSER_API_KEY, rate_limit=rate_limits.get("Mouser", 0.5), pool_size=args.fetch_workers)
+    digikey = DigiKey(DIGIKEY_CLIENT_ID, DIGIKEY_CLIENT_SECRET, rate_limit=rate_limits.get("Digi-Key", 2), pool_size=args.fetch_workers)
+    lcsc = LCSC(rate_limit=rate_limits.get("LCSC", 5), pool_size=args.fetch_workers)
+    
+    if args.distributor_cache:
+        cache = ResponseCache(args.distributor_cache, ttls={'prices': args.price_max_age})
+    else:
+        cache = None
+    
+    if args.photo_index:
+        pk.photo_index = PhotoIndex(args.photo_index)
+    
+    if args.catalog:
+        source = PartCatalog(pk, args.catalog, args.catalog_max_age)
+    else:
+        source = pk
     
     if args.action == 'sync-distributors':
+        journal = None
         if args.id:
             print("Getting part")
-            parts = [pk.get_part(args.id)]
+            parts = [source.get_part(args.id)]
+            num_parts = 1
+        elif args.resume:
+            journal = SyncJournal(args.journal)
+            if not journal.load():
+                print("Error: No sync journal to resume from!")
+                return
+            if journal.complete:
+                # The journal knows every part of the interrupted run, so only the unfinished ones are fetched
+                part_ids = journal.remaining()
+                print("Resuming sync, getting {} remaining parts".format(len(part_ids)))
+                parts = (part for part in (pk.get_part(part_id.split("/")[-1]) for part_id in part_ids) if '@id' in part)
+                num_parts = len(part_ids)
+            else:
+                print("Resuming sync, getting parts")
+                all_parts = source.iter_parts()
+                parts = (part for part in all_parts if part['@id'] not in journal.done)
+                num_parts = len(all_parts) - len(journal.done)
         else:
+            journal = SyncJournal(args.journal)
+            journal.start()
             print("Getting parts")
-            parts = pk.get_parts()
+            parts = source.iter_parts()
+            num_parts = len(parts)
         
         print("Getting manufacturers")
-        manufacturers = pk.get_manufacturers()
+        manufacturers = source.get_manufacturers()
         manufacturer_ids_by_name = dict([(mf['name'].lower(), mf['@id']) for mf in manufacturers])
         
-        if args.offset:
-            parts = parts[args.offset:]
-        
-        num_parts = len(parts)
-        errors = []
-        for i, part in enumerate(parts):
-            print("  [{: 5d}/{: 5d}] Processing {}".format(i+1, num_parts, part['name']))
-            
-            part_distributors = part['distributors']
-            part_manufacturers = part['manufacturers']
-            part_manufacturer_ids_by_name = dict([(mf['manufacturer']['name'].lower(), mf['@id']) for mf in part_manufacturers])
-            
-            for distributor in part_distributors:
-                distributor_name = distributor['distributor']['name']
-                if distributor_name not in SUPPORTED_DISTRIBUTORS.values():
-                    print("    Skipping distributor {}".format(distributor_name))
-                    continue
-                
-                print("    Processing distributor {}".format(distributor_name))
-                order_no = distributor['orderNumber']
-                part_data = get_part_data(distributor_name, order_no, tme, mouser, digikey, lcsc)
-                if not part_data:
-                    print("      Failed to get part data!")
-                    errors.append(part['name'])
-                    continue
-                part = pk.update_part_data(part, part_data, distributor, manufacturer_ids_by_name)
-            time.sleep(0.2) # To ensure we don't exceed 5 API calls per second
+        offset = args.offset or 0
+        pipeline = SyncPipeline(pk, tme, mouser, digikey, lcsc, manufacturer_ids_by_name, cache, fetch_workers=args.fetch_workers, write_workers=args.write_workers, journal=journal, reload_parts=source is not pk)
+        errors = pipeline.run(itertools.islice(parts, offset, None), num_parts, offset)
+        if journal:
+            journal.close()
+        pk.print_write_summary()
         
         if errors:
             print("Parts with errors:")
@@ -92,7 +133,7 @@ def main():
     
     elif args.action == 'list-empty-part-mf':
         print("Getting parts")
-        parts = pk.get_parts()
+        parts = source.iter_parts()
         num_parts = len(parts)
         
         empty_mf_parts = []
@@ -112,15 +153,15 @@ def main():
         
         if args.id:
             print("Getting part")
-            parts = [pk.get_part(args.id)]
+            parts = [source.get_part(args.id)]
         else:
             print("Getting parts")
-            parts = pk.get_parts()
+            parts = source.get_parts()
         
         part_indices_by_name = dict([(part['name'].lower(), index) for index, part in enumerate(parts)])
         
         print("Getting storage locations")
-        locations = pk.get_storage_locations()
+        locations = source.get_storage_locations()
         location_ids_by_name = dict([(loc['name'].lower(), loc['@id']) for loc in locations])
         
         entries = []
@@ -141,7 +182,10 @@ def main():
                 continue
             
             part_index = part_indices_by_name[name.lower()]
-            part = parts[part_index]
+            part = get_current_part(pk, source, parts[part_index])
+            if '@id' not in part:
+                print("  Failed to get part, skipping")
+                continue
             if part['storageLocation'] and not args.force:
                 print("  Part already has storage location assigned, skipping (use -f to override)")
                 continue
@@ -169,7 +213,7 @@ def main():
         label_height_px = round((args.label_height / 25.4) * args.label_dpi)
         
         print("Getting parts")
-        parts = pk.get_parts()
+        parts = source.iter_parts()
         parts_by_location = {}
         
         for part in parts:
@@ -177,72 +221,49 @@ def main():
                 continue
             loc_name = part['storageLocation']['name']
             if loc_name in parts_by_location:
-                parts_by_location[loc_name].append(part)
+                parts_by_location[loc_name].append(get_label_entry(part))
             else:
-                parts_by_location[loc_name] = [part]
+                parts_by_location[loc_name] = [get_label_entry(part)]
         
+        manifest = load_label_manifest(args.label_manifest)
+        label_hashes = {}
         labels = []
-        font = ImageFont.truetype("LiberationSans-Regular.ttf", args.font_size)
-        for loc_name, parts in sorted(parts_by_location.items(), key=lambda e: e[0]):
+        for loc_name, entries in sorted(parts_by_location.items(), key=lambda e: e[0]):
             if args.location and loc_name.lower() != args.location.lower():
                 continue
             
-            if len(parts) > args.max_parts_per_label:
-                print("Skipping storage location {}: {} parts".format(loc_name, len(parts)))
+            if len(entries) > args.max_parts_per_label:
+                print("Skipping storage location {}: {} parts".format(loc_name, len(entries)))
                 continue
-            print("Processing storage location {}: {} parts".format(loc_name, len(parts)))
-            
-            img = Image.new("RGB", (label_width_px, label_height_px), 'white')
-            draw = ImageDraw.Draw(img)
-            
-            margin = round(max(label_height_px * 0.02, label_width_px * 0.02))
-            avail_label_height = label_height_px - 2 * margin
-            avail_label_width = label_width_px - 2 * margin
-            
-            # Split label into base grid with fixed height location tag and variable height parts areas
-            base_x = margin
-            loc_area_y = margin
-            loc_area_height = round(args.font_size * 1.5)
-            parts_area_y = loc_area_y + loc_area_height
-            parts_area_height = avail_label_height - loc_area_height
-            
-            # Split parts area into evenly-spaced grid
-            parts_area_region_height = parts_area_height // len(parts)
-            parts_area_regions_y = []
-            for i in range(len(parts)):
-                region_y = parts_area_y + parts_area_region_height * i
-                parts_area_regions_y.append(region_y)
-            
-            draw.text((base_x, loc_area_y), "Location: {}".format(loc_name), 'black', font=font)
-            
-            for i, part in enumerate(sorted(parts, key=lambda p: p['@id'])):
-                barcode_text = "{}: {}".format(part['category']['name'], part['name'])
-                
-                part_id = part['@id'].split("/")[-1]
-                barcode_height = parts_area_region_height - round(args.font_size * 1.5)
-                barcode_thickness = avail_label_width // 100
-                
-                barcode = code128.image("P" + part_id, height=barcode_height, thickness=barcode_thickness, quiet_zone=False)
-                barcode_x = (avail_label_width - (barcode.size[0])) // 2
-                barcode_y = parts_area_regions_y[i]
-                img.paste(barcode, (barcode_x, barcode_y))
-                
-                name_x = barcode_x
-                name_y = barcode_y + barcode_height + args.font_size * 0.1
-                draw.text((name_x, name_y), barcode_text, 'black', font=font)
-            
-            labels.append(img)
+            label_hashes[loc_name] = get_label_hash(entries)
+            if args.changed_only and manifest.get(loc_name) == label_hashes[loc_name]:
+                continue
+            print("Processing storage location {}: {} parts".format(loc_name, len(entries)))
+            labels.append((loc_name, entries))
+        
+        if not labels:
+            print("No labels to generate")
+            return
         
         print("Generating PDF")
-        labels[0].save(args.label_file, "PDF", resolution=args.label_dpi, save_all=True, append_images=labels[1:])
+        if args.label_format == "vector":
+            num_pages = save_labels_vector_pdf(labels, args.label_file, label_width_px, label_height_px, args.font_size, args.label_dpi)
+        else:
+            images = render_labels(labels, label_width_px, label_height_px, args.font_size, args.render_workers)
+            num_pages = save_labels_pdf(images, args.label_file, args.label_dpi)
+        print("Wrote {} labels to {}".format(num_pages, args.label_file))
+        
+        # Only remember the labels once they have been written
+        manifest.update(label_hashes)
+        save_label_manifest(args.label_manifest, manifest)
     
     elif args.action == 'rename-from-params':
         if args.id:
             print("Getting part")
-            parts = [pk.get_part(args.id)]
+            parts = [source.get_part(args.id)]
         else:
             print("Getting parts")
-            parts = pk.get_parts()
+            parts = source.iter_parts()
         
         num_parts = len(parts)
         for i, part in enumerate(parts):
@@ -278,6 +299,10 @@ def main():
             accept = input("    Rename {} to {}? [Y/n] ".format(part['name'], new_name)).lower() in ("", "y")
             if accept:
                 print("    Updating part")
+                part = get_current_part(pk, source, part)
+                if '@id' not in part:
+                    print("    Failed to get part!")
+                    continue
                 part['name'] = new_name
                 result = pk.update_part(part)
     
@@ -290,7 +315,7 @@ def main():
         project = pk.get_project(args.project_id)
         
         print("Getting parts")
-        parts = pk.get_parts()
+        parts = source.get_parts()
         
         part_indices_by_order_no = {}
         for index, part in enumerate(parts):
@@ -335,7 +360,7 @@ def main():
             return
         
         print("Getting parts")
-        parts = pk.get_parts()
+        parts = source.get_parts()
         
         part_indices_by_order_no = {}
         for index, part in enumerate(parts):